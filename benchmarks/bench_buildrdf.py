@@ -0,0 +1,73 @@
+"""Time BuildRdf conversion of a synthetic pre-RDF tsv file.
+
+Usage: python benchmarks/bench_buildrdf.py [rows] [records_per_file]
+"""
+import codecs
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from buildrdf import BuildRdf
+
+HEADINGS = ["discipline", "federation", "language", "creator", "id", "title", "archive", "genre",
+            "original_query", "subjects", "date", "type", "thumbnail", "seeAlso", "source",
+            "description", "role", "image"]
+
+TITLES = [u"The abolitionists; a collection of their writing",
+          u"[Letter to] To the Abolitionists of Great Britain [manuscript]",
+          u"Christian radicalism",
+          u"[Manuscript] notes on reform"]
+DATES = [u"[1963]", u"1963", u"1900-1910", u"", u"circa 1850s"]
+TYPES = [u"text", u"image", u"sound"]
+
+
+def write_tsv(path, rows):
+    """Write a tsv file of synthetic rows in the layout produced by DplaApi.create_tsv."""
+    with codecs.open(path, "w", "utf-8") as tsv_file:
+        tsv_file.write("\t".join(HEADINGS) + "\n")
+        for i in range(rows):
+            row = {
+                "discipline": u"History | Literature" if i % 2 else u"",
+                "federation": u"SiRO",
+                "language": u"English",
+                "creator": u"Ruchames, Louis, 1917- | Garrison, William Lloyd, 1805-1879" if i % 3 else u"",
+                "id": u"http://dp.la/api/items/{0:032x}".format(i),
+                "title": TITLES[i % len(TITLES)],
+                "archive": u"",
+                "genre": u"none" if i % 4 else u"fiction|poetry",
+                "original_query": u"abolitionists movements",
+                "subjects": u"Antislavery movements--United States | Abolitionists",
+                "date": DATES[i % len(DATES)],
+                "type": TYPES[i % len(TYPES)],
+                "thumbnail": u"https://books.google.com/books/content?id={0}".format(i) if i % 2 else u"",
+                "seeAlso": u"http://catalog.hathitrust.org/Record/{0:09d}".format(i),
+                "source": u"HathiTrust",
+                "description": u"A collection of writings." if i % 5 else u"",
+                "role": u"",
+                "image": u"",
+            }
+            tsv_file.write("\t".join(row[heading] for heading in HEADINGS) + "\t\n")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    records_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    work_dir = tempfile.mkdtemp()
+    try:
+        tsv_path = os.path.join(work_dir, "bench.tsv")
+        write_tsv(tsv_path, rows)
+        start = time.time()
+        BuildRdf().build_rdf_from_tsv(tsv_path, os.path.join(work_dir, "bench.xml"),
+                                      records_per_file=records_per_file)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(work_dir)
+    print("{0} records in {1:.2f}s: {2:.1f} us/record, {3:.0f} records/s".format(
+        rows, elapsed, elapsed / rows * 1e6, rows / elapsed))
+
+
+if __name__ == "__main__":
+    main()
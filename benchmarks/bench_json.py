@@ -0,0 +1,45 @@
+"""Time decoding a page of DPLA search results with each installed JSON library.
+
+The page holds copies of data/sample_dpla_record.json, and is decoded from
+its utf-8 bytes as a search response would be.
+
+Usage: python benchmarks/bench_json.py [page_size] [repeats]
+"""
+import ast
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import fastjson
+
+
+def make_page(page_size):
+    """Return the encoded body of a search response with page_size items."""
+    with open(os.path.join(ROOT, "data", "sample_dpla_record.json")) as sample_file:
+        item = ast.literal_eval(sample_file.read())
+    return json.dumps({"count": page_size, "start": 0, "limit": page_size, "docs": [item] * page_size})
+
+
+def main():
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    page = make_page(page_size)
+    print("Page of {0} items: {1:.0f} KB".format(page_size, len(page) / 1024.0))
+    for name in fastjson.DECODERS:
+        try:
+            fastjson.set_decoder(name)
+        except ImportError:
+            print("{0:>7}: not installed".format(name))
+            continue
+        start = time.time()
+        for _ in range(repeats):
+            fastjson.loads(page)
+        elapsed = (time.time() - start) / repeats
+        print("{0:>7}: {1:.1f} ms/page".format(name, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Time per-item DplaMetadata.compile against DplaMetadata.compile_batch.
+
+Items are variations on data/sample_dpla_record.json, covering each shape of
+the date, title, description and type fields that compile() handles.
+
+Usage: python benchmarks/bench_metadpla.py [items] [page_size]
+"""
+import ast
+import copy
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from metadpla import DplaMetadata
+
+DATES = [[{u"displayDate": u"1900", u"begin": u"1900", u"end": u"1900"}],
+         [{u"begin": u"1850", u"end": u"1859"}],
+         {u"displayDate": [u"1963", u"[1963]"]},
+         {u"displayDate": u"circa 1850s"}]
+
+
+def load_sample():
+    """Return the "sourceResource" of the sample record, which is stored as a Python literal."""
+    with open(os.path.join(ROOT, "data", "sample_dpla_record.json")) as sample_file:
+        return ast.literal_eval(sample_file.read())["sourceResource"]
+
+
+def make_sources(count):
+    """Return count "sourceResource" objects shaped like the sample record."""
+    sample = load_sample()
+    sources = []
+    for i in range(count):
+        source = copy.deepcopy(sample)
+        source[u"date"] = copy.deepcopy(DATES[i % len(DATES)])
+        if i % 2:
+            source[u"title"] = [source.get(u"title", u"Untitled"), u"Alternate title"]
+        if i % 3 == 0:
+            source.pop(u"description", None)
+        if i % 5 == 0:
+            source.pop(u"language", None)
+        if i % 7 == 0:
+            source[u"type"] = u"text"
+        sources.append(source)
+    return sources
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    sources = make_sources(count)
+    pages = [sources[start:start + page_size] for start in range(0, count, page_size)]
+
+    start = time.time()
+    item_records = []
+    for source in sources:
+        metadata = DplaMetadata(source)
+        metadata.compile()
+        item_records.append(metadata.record)
+    item_elapsed = time.time() - start
+
+    start = time.time()
+    columns = [DplaMetadata.compile_batch(page) for page in pages]
+    columns_elapsed = time.time() - start
+    batch_records = []
+    for page_columns in columns:
+        batch_records.extend(DplaMetadata.batch_records(page_columns))
+    batch_elapsed = time.time() - start
+
+    if [record.to_dict() for record in item_records] != [record.to_dict() for record in batch_records]:
+        sys.exit("compile_batch output differs from compile")
+    timings = (("compile", item_elapsed), ("compile_batch", columns_elapsed),
+               ("+ records", batch_elapsed))
+    for label, elapsed in timings:
+        print("{0:>14}: {1} records in {2:.2f}s: {3:.1f} us/record".format(
+            label, count, elapsed, elapsed / count * 1e6))
+
+
+if __name__ == "__main__":
+    main()
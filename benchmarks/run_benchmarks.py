@@ -0,0 +1,204 @@
+"""Offline benchmarks of the harvest pipeline, against a local stub server.
+
+Each stage runs in its own process, in a fresh working directory with a
+generated default.cfg, and reports its throughput and peak memory (max RSS).
+Searches and HathiTrust lookups are answered by benchmarks/stub_server.py,
+so results do not depend on the network or on API quota.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--items N] [--latency SECONDS] [--output results.json]
+    python benchmarks/run_benchmarks.py --compare baseline.json [--tolerance 0.2]
+
+With --compare, the exit status is 1 if any stage is slower, or uses more
+memory, than in the baseline results by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARK_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARK_DIR)
+from stub_server import StubServer, SyntheticItems
+
+CASES = ["compile", "search", "build_arc_rdf_dataset", "enrich_genres", "create_tsv", "build_rdf_from_tsv"]
+
+CONFIG = """[dpla_api]
+api_key = 00000000000000000000000000000000
+
+[check_match]
+match_file = {work_dir}/dpla_records.json
+reset_match_file = false
+
+[search]
+workers = {workers}
+requests_per_second = 1000
+project_fields = false
+
+[hathi]
+enrich_genres = false
+genre_cache = {work_dir}/hathi_genres.tsv
+workers = {workers}
+"""
+
+
+def peak_memory_mb():
+    """Return the peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def make_api(dpla_url, hathi_url):
+    """Return a DplaApi that sends its requests to the stub server."""
+    from dpla_api import DplaApi
+    from hathi import HathiBibApi
+    api = DplaApi()
+    api.client.search_url = dpla_url
+    api.hathi_api = HathiBibApi(pool_size=api.hathi_settings["workers"])
+    api.hathi_api.base_url_multi = hathi_url
+    api.query = "benchmark"
+    return api
+
+
+def run_case(case, count, dpla_url, hathi_url):
+    """Set up and time one stage; returns (items processed, seconds, peak MB before timing).
+
+    Synthetic items are generated as they are consumed, so the peak memory
+    measured is that of the pipeline rather than of a list of test items.
+    """
+    from buildrdf import BuildRdf
+    from metadpla import DplaMetadata
+    api = make_api(dpla_url, hathi_url)
+    items = SyntheticItems(count).items()
+
+    if case == "build_rdf_from_tsv":
+        api.create_tsv(api.iter_arc_records(items, check_match=False), output_path="bench.tsv")
+        setup_mb = peak_memory_mb()
+        start = time.time()
+        BuildRdf().build_rdf_from_tsv("bench.tsv", "rdf/bench.xml")
+        return count, time.time() - start, setup_mb
+    if case == "search":
+        setup_mb = peak_memory_mb()
+        start = time.time()
+        api.search("benchmark", page_size=500)
+        return len(api.all_returned_items), time.time() - start, setup_mb
+    if case == "compile":
+        # Only the sourceResource of each item is kept, which is a small part of it.
+        sources = [item["sourceResource"] for item in items]
+        setup_mb = peak_memory_mb()
+        start = time.time()
+        for source in sources:
+            DplaMetadata(source).compile()
+        return len(sources), time.time() - start, setup_mb
+    if case in ("build_arc_rdf_dataset", "enrich_genres"):
+        setup_mb = peak_memory_mb()
+        start = time.time()
+        api.build_arc_rdf_dataset(items=items, enrich_genres=case == "enrich_genres")
+        elapsed = time.time() - start
+        if case == "enrich_genres":
+            # Every synthetic item has a HathiTrust record whose genre code is mapped.
+            missing = sum(1 for record in api.metadata_records if record["genre"] == "none")
+            if missing:
+                raise RuntimeError("{0} of {1} records have no genre".format(missing, len(api.metadata_records)))
+        return len(api.metadata_records), elapsed, setup_mb
+    if case == "create_tsv":
+        setup_mb = peak_memory_mb()
+        start = time.time()
+        api.create_tsv(api.iter_arc_records(items, check_match=False), output_path="bench.tsv")
+        return count, time.time() - start, setup_mb
+    raise ValueError("Unknown benchmark: {0}".format(case))
+
+
+def run_child(args):
+    """Run a single stage in this process and print its result as the last line."""
+    os.chdir(args.work_dir)
+    records, elapsed, setup_mb = run_case(args.case, args.items, args.dpla_url, args.hathi_url)
+    print("RESULT " + json.dumps({"case": args.case, "items": records, "seconds": elapsed,
+                                  "items_per_second": records / elapsed if elapsed else 0.0,
+                                  "setup_mb": setup_mb, "peak_mb": peak_memory_mb()}))
+
+
+def run_all(args):
+    """Run each stage in a child process and collect the results."""
+    server = StubServer(items=args.items, latency=args.latency, error_rate=args.error_rate)
+    server.start()
+    results = []
+    try:
+        for case in args.cases:
+            work_dir = tempfile.mkdtemp()
+            try:
+                os.mkdir(os.path.join(work_dir, "rdf"))
+                with open(os.path.join(work_dir, "default.cfg"), "w") as config_file:
+                    config_file.write(CONFIG.format(work_dir=work_dir, workers=args.workers))
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--case", case,
+                                                  "--items", str(args.items), "--work-dir", work_dir,
+                                                  "--dpla-url", server.dpla_url,
+                                                  "--hathi-url", server.hathi_url])
+            finally:
+                shutil.rmtree(work_dir)
+            result = json.loads(output.strip().splitlines()[-1][len("RESULT "):])
+            print("{case:>22}: {items} items in {seconds:.2f}s, {items_per_second:.0f} items/s, "
+                  "peak {peak_mb:.0f} MB (setup {setup_mb:.0f} MB)".format(**result))
+            results.append(result)
+    finally:
+        server.stop()
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    """Print stages that regressed against baseline results; returns True if any did."""
+    with open(baseline_path, "r") as baseline_file:
+        baseline = dict((result["case"], result) for result in json.load(baseline_file)["results"])
+    regressed = False
+    for result in results:
+        previous = baseline.get(result["case"])
+        if previous is None:
+            continue
+        if result["items_per_second"] < previous["items_per_second"] * (1 - tolerance):
+            print("REGRESSION {0}: {1:.0f} items/s, baseline {2:.0f} items/s".format(
+                result["case"], result["items_per_second"], previous["items_per_second"]))
+            regressed = True
+        if result["peak_mb"] > previous["peak_mb"] * (1 + tolerance):
+            print("REGRESSION {0}: peak {1:.0f} MB, baseline {2:.0f} MB".format(
+                result["case"], result["peak_mb"], previous["peak_mb"]))
+            regressed = True
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the harvest pipeline against a local stub server.")
+    parser.add_argument("--items", type=int, default=20000, help="synthetic items per stage")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of stub server delay per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of search requests that fail")
+    parser.add_argument("--workers", type=int, default=4, help="search and HathiTrust worker threads")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fraction of slowdown or growth")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--dpla-url", help=argparse.SUPPRESS)
+    parser.add_argument("--hathi-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_child(args)
+        return
+    results = run_all(args)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"items": args.items, "latency": args.latency, "error_rate": args.error_rate,
+                       "workers": args.workers,
+                       "results": results}, output_file, indent=2)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
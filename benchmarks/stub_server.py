@@ -0,0 +1,197 @@
+"""Local stand-in for the DPLA search API and the HathiTrust bib API.
+
+Serves synthetic items made from data/sample_dpla_record.json, so the harvest
+pipeline can be timed without network access or API quota. Item n has a
+distinct DPLA id and HathiTrust record number, and pages are built when
+requested, so the number of items served is only limited by time.
+
+A fraction of search requests can be answered with 429 and 503 errors, to
+time the client's retries.
+
+Usage: python benchmarks/stub_server.py [--items N] [--latency SECONDS] [--error-rate FRACTION] [--port PORT]
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import argparse
+import ast
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import urllib
+import urlparse
+from cStringIO import StringIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ITEM_MARKER = "00000000000000000000000000item00"
+RECORD_MARKER = "000record"
+MARC_XML = (u'<?xml version="1.0" encoding="UTF-8"?><collection xmlns="http://www.loc.gov/MARC21/slim">'
+            u'<record><leader>00707nam a2200217K 4500</leader>'
+            u'<controlfield tag="001">{0}</controlfield>'
+            u'<controlfield tag="008">850213s1836    mau           000 {1} eng d</controlfield>'
+            u'</record></collection>')
+GENRE_CODES = "01fpj"
+
+
+def load_sample_item():
+    """Return data/sample_dpla_record.json, which is stored as a Python literal."""
+    with open(os.path.join(ROOT, "data", "sample_dpla_record.json")) as sample_file:
+        return ast.literal_eval(sample_file.read())
+
+
+def item_template():
+    """Return the sample item as JSON, with markers in place of its ids."""
+    item = load_sample_item()
+    record_id = item["originalRecord"]["_id"]
+    text = json.dumps(item)
+    return text.replace(item["id"], ITEM_MARKER).replace(record_id, RECORD_MARKER)
+
+
+class SyntheticItems(object):
+    """Numbered synthetic DPLA items, serialized from a template of the sample item."""
+
+    def __init__(self, count):
+        """Prepare template.
+
+        args:
+            count(int): number of items matching every search.
+        """
+        self.count = count
+        self.template = item_template()
+
+    def item_json(self, n):
+        """Return item n as JSON."""
+        return self.template.replace(ITEM_MARKER, "{0:032x}".format(n)).replace(RECORD_MARKER,
+                                                                                 "{0:09d}".format(n))
+
+    def page_json(self, page, page_size):
+        """Return the body of a search response for a page of results."""
+        start = (page - 1) * page_size
+        docs = ",".join(self.item_json(n) for n in range(start, min(start + page_size, self.count)))
+        return '{{"count": {0}, "start": {1}, "limit": {2}, "docs": [{3}]}}'.format(
+            self.count, start, page_size, docs)
+
+    def items(self, start=0, stop=None):
+        """Yield items as decoded dicts, as iter_search would."""
+        for n in range(start, self.count if stop is None else stop):
+            yield json.loads(self.item_json(n))
+
+
+def hathi_json(request_keys):
+    """Return the body of a HathiTrust multi-id response.
+
+    args:
+        request_keys(list): "recordnumber:<id>" keys of the request.
+    """
+    results = {}
+    for request_key in request_keys:
+        record_id = request_key.partition(":")[2]
+        code = GENRE_CODES[int(record_id) % len(GENRE_CODES)] if record_id.isdigit() else " "
+        results[request_key] = {"records": {record_id: {"marc-xml": MARC_XML.format(record_id, code)}},
+                                "items": []}
+    return json.dumps(results)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Answer DPLA search and HathiTrust multi-id requests."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        time.sleep(self.server.latency)
+        if url.path == "/v2/items" and random.random() < self.server.error_rate:
+            self.send_response(random.choice([429, 503]))
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if url.path == "/v2/items":
+            params = urlparse.parse_qs(url.query)
+            body = self.server.items.page_json(int(params.get("page", ["1"])[0]),
+                                               int(params.get("page_size", ["10"])[0]))
+        elif url.path.startswith("/api/volumes/full/json/"):
+            request_keys = urllib.unquote(url.path.rsplit("/", 1)[1]).split("|")
+            body = hathi_json(request_keys)
+        else:
+            self.send_error(404)
+            return
+        self.send_body(body)
+
+    def send_body(self, body):
+        """Send a JSON response, gzip-compressed if the client accepts it."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            buffer = StringIO()
+            with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=1) as gzip_file:
+                gzip_file.write(body)
+            body = buffer.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Threaded stub server, run in a background thread by start()."""
+
+    daemon_threads = True
+
+    def __init__(self, items=10000, latency=0.0, port=0, error_rate=0.0):
+        """Bind to a local port.
+
+        kwargs:
+            items(int): number of items matching every search.
+            latency(float): seconds to wait before answering each request.
+            port(int): port to listen on; by default a free port is chosen.
+            error_rate(float): fraction of search requests answered with a 429 or 503 error.
+        """
+        HTTPServer.__init__(self, ("127.0.0.1", port), StubRequestHandler)
+        self.items = SyntheticItems(items)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    @property
+    def dpla_url(self):
+        """Value for AsyncDplaClient.search_url."""
+        return "http://127.0.0.1:{0}/v2/items".format(self.server_port)
+
+    @property
+    def hathi_url(self):
+        """Value for HathiBibApi.base_url_multi."""
+        return "http://127.0.0.1:{0}/api/volumes/<resulttype>/json/<requests>".format(self.server_port)
+
+    def start(self):
+        """Serve requests from a daemon thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic DPLA and HathiTrust responses.")
+    parser.add_argument("--items", type=int, default=10000, help="items matching every search")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of delay per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of search requests that fail")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    server = StubServer(items=args.items, latency=args.latency, port=args.port, error_rate=args.error_rate)
+    print("DPLA search url: {0}".format(server.dpla_url))
+    print("HathiTrust url: {0}".format(server.hathi_url))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
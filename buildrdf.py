@@ -1,13 +1,98 @@
 """Build individual RDF XML records from spreadsheet rows."""
 import os
 from lxml import etree
+from itertools import islice
+from multiprocessing import Pool
 import re
 import codecs
+import io
+import json
+from tsvwriter import format_value
+
+# Title and date patterns used by the genre, type and date heuristics.
+LETTER_PATTERN = re.compile(r'\[.*[Ll]etter.*\]')
+MANUSCRIPT_PATTERN = re.compile(r'\[.*[Mm]anuscript.*\]')
+YEAR_PATTERN = re.compile(r'[0-9]{4}')
+YEAR_ONLY_PATTERN = re.compile(r'^[0-9]{4}$')
+
+
+def _build_shard(task):
+    """Build one RDF output file from a byte range of the tsv file.
+
+    Module-level so it can be sent to a process pool.
+
+    args:
+    task (tuple) -- archive, tsv path, headings, start and end byte offsets, output path.
+    """
+    archive, tsv_path, headings, start, end, output_path = task
+    with open(tsv_path, "rb") as tsv_file:
+        tsv_file.seek(start)
+        lines = tsv_file.read(end - start).decode("utf-8").split("\n")
+    # Keep line endings, as they are kept when reading the file line by line.
+    lines = [line + "\n" for line in lines[:-1]] + [line for line in lines[-1:] if line]
+    rows = [dict(zip(headings, line.split("\t"))) for line in lines]
+    return BuildRdf(archive)._build_rdf_file(rows, output_path, headings)
+
+
+class RdfFileWriter(object):
+    """Write records to an RDF file one at a time, without keeping them in memory.
+
+    Each record is briefly attached to an empty rdf:RDF root, so it is
+    serialized with the root's namespace prefixes and indentation, and the
+    file comes out exactly as if the whole tree had been pretty-printed at once.
+    """
+
+    def __init__(self, output_path, ns_map):
+        """Prepare writer; the file is only created on the first write or on close.
+
+        args:
+        output_path (str) -- path of the file to write.
+        ns_map (dict) -- namespace prefixes declared on the rdf:RDF root.
+        """
+        self.output_path = output_path
+        self.holder = etree.Element("{{{0}}}RDF".format(ns_map["rdf"]), nsmap=ns_map)
+        self.output_file = None
+        self.records_written = 0
+
+    def write(self, record):
+        """Serialize a record to the file and release it.
+
+        args:
+        record (Element) -- sro record built from a tsv row.
+        """
+        self.holder.append(record)
+        text = etree.tostring(self.holder, encoding="unicode", pretty_print=True)
+        self.holder.remove(record)
+
+        body_start = text.index("\n") + 1
+        body_end = text.rindex("</")
+        if self.output_file is None:
+            self.output_file = codecs.open(self.output_path, "w", "utf-8")
+            self.output_file.write(text[:body_start])
+            self.closing_tag = text[body_end:]
+        self.output_file.write(text[body_start:body_end])
+        self.records_written += 1
+
+    def close(self):
+        """Close the root element and the file."""
+        if self.output_file is None:
+            # No records: write the empty root on its own.
+            with codecs.open(self.output_path, "w", "utf-8") as output_file:
+                output_file.write(etree.tostring(self.holder, encoding="unicode", pretty_print=True))
+            return
+        self.output_file.write(self.closing_tag)
+        self.output_file.close()
+        self.output_file = None
+
 
 
 class BuildRdf():
     """Class to build RDF according to ARC standard."""
 
+    # Columns read by the element builders, filled with "" when building from records.
+    record_columns = ["id", "title", "creator", "role", "source", "description", "subjects", "archive",
+                      "discipline", "genre", "type", "date", "language", "seeAlso", "thumbnail", "image"]
+
     def __init__(self, archive="dpla"):
         """Load default values."""
         self.default_values = {
@@ -26,18 +111,23 @@ class BuildRdf():
             "dc": "http://purl.org/dc/elements/1.1/",
             "sro": "http://www.lib.msu.edu/sro/schema#",
         }
+        self.qualified_names = {}
         self.file_count = 0
 
     def __set_rdf_root(self):
-        """Set or reset RDF root to rebegin new file."""
-        self.rdf_root = etree.Element("{{{0}}}RDF".format(self.ns_map["rdf"]), nsmap=self.ns_map)
+        """Set or reset RDF writer to rebegin new file."""
+        self.rdf_writer = RdfFileWriter(self.__shard_path(self.file_count), self.ns_map)
 
-    def build_rdf_from_tsv(self, tsv_path, output_path, lines_to_process=None, records_per_file=500):
+    def build_rdf_from_tsv(self, tsv_path, output_path, lines_to_process=None, records_per_file=500,
+                           processes=None):
         """Initialize processing of tsv file.
 
         args:
         tsv_path (str) -- path to tsv file.
         lines_to_process (int) -- allow user to determine number of lines in tsv to process.
+            By default, every line is processed.
+        processes (int) -- build output files in parallel across this many processes.
+            Output is identical to the serial path, plus a manifest listing the files.
         """
         self.records_per_file = records_per_file
         self.output_path = output_path
@@ -52,7 +142,10 @@ class BuildRdf():
         """
         self.__set_rdf_root()
 
-        if self.__check_file():
+        if self.__check_file() and processes and processes > 1:
+            self.__build_parallel(processes)
+
+        elif self.__check_file():
             self.__read_tsv()
             self.__write_rdf()
             print("Processed {0} records".format(self.lines_processed))
@@ -60,51 +153,158 @@ class BuildRdf():
         else:
             print("Invalid path -- File Doesn't Exist: {0}".format(self.tsv_path))
 
-    def __read_tsv(self):
-        """Open and read file."""
-        with codecs.open(self.tsv_path, "r", "utf-8") as tsv_file:
+    def build_rdf_from_records(self, records, output_path, records_per_file=500):
+        """Build RDF directly from metadata records, without an intermediate tsv file.
+
+        Records get the same defaults and heuristics as rows of a tsv file
+        written by DplaApi.create_tsv, and are written in a single streaming pass.
+
+        args:
+        records (iterable) -- metadata records from DplaApi, e.g. DplaApi.iter_arc_records.
+        output_path (str) -- path of the first output file.
+        records_per_file (int) -- number of records written to each file.
+        """
+        self.records_per_file = records_per_file
+        self.output_path = output_path
+        self.__compile_plan(self.record_columns)
+        self.__set_rdf_root()
+        print("Processing records...")
+        self.__build_rows(self.__record_to_row(record) for record in records)
+        self.__write_rdf()
+        print("Processed {0} records".format(self.lines_processed))
 
-            if not self.lines_to_process:
-                self.lines_to_process = len(tsv_file.readlines())
+    def __record_to_row(self, record):
+        """Put a metadata record's values in the form the element builders read from a tsv row.
 
-            print("Processing {0} records...".format(self.lines_to_process - 1))
+        Values are formatted by tsvwriter.format_value, as in DplaApi.create_tsv
+        (without its tab and line break cleanup), and columns missing from the
+        record are blank.
 
-            # The previous readlines() call moved the pointer to the end of the file, making iteration
-            # impossible. This line resets the pointer.
-            tsv_file.seek(0)
+        args:
+        record (dict) -- metadata record from DplaApi.
+        """
+        row = dict.fromkeys(self.record_columns, u"")
+        for key, value in record.items():
+            row[key] = format_value(value)
+        return row
 
-            # Skip first line (headings)
+    def __read_tsv(self):
+        """Read file in a single pass, processing each row as it is read."""
+        print("Processing records from {0}...".format(self.tsv_path))
+        self.__build_rows(self.__iter_rows())
+
+    def __build_rows(self, rows):
+        """Build and write RDF for each row, starting a new file every records_per_file rows."""
+        self.lines_processed = 0
+        for row in rows:
+            rdf = self.__process_line(row)
+            self.rdf_writer.write(rdf)
+            self.lines_processed += 1
+
+    def __iter_rows(self):
+        """Yield each row of the tsv file as a dict keyed by heading.
+
+        Stops after lines_to_process rows, if set.
+        """
+        # Lines end only at "\n", matching the byte offsets used by the parallel path.
+        with io.open(self.tsv_path, "r", encoding="utf-8", newline="\n") as tsv_file:
+            # First line holds the headings.
             self.headings = [h.strip() for h in tsv_file.readline().split("\t")]
+            self.__compile_plan(self.headings)
+            for line in islice(tsv_file, self.lines_to_process):
+                row = {}
+                row.update(zip(self.headings, line.split("\t")))
+                yield row
+
+    def __build_parallel(self, processes):
+        """Split the tsv into byte ranges of records_per_file rows and build each file in a process pool."""
+        shards = self.__scan_shards()
+        print("Processing records from {0} across {1} processes...".format(self.tsv_path, processes))
+        tasks = []
+        for index, (start, end, rows) in enumerate(shards):
+            tasks.append((self.default_values["archive"][0], self.tsv_path, self.headings,
+                          start, end, self.__shard_path(self.file_count + index)))
+
+        pool = Pool(processes)
+        try:
+            manifest = []
             self.lines_processed = 0
-            for line in tsv_file:
-                if self.lines_to_process > self.lines_processed:
-                    rdf = self.__process_line(line)
-                    self.rdf_root.append(rdf)
-                    self.lines_processed += 1
+            for task, records in zip(tasks, pool.imap(_build_shard, tasks)):
+                self.lines_processed += records
+                manifest.append({"path": task[5], "records": records})
+                print("Processed {0} records".format(self.lines_processed))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.file_count += len(tasks)
+        with open(os.path.splitext(self.output_path)[0] + "_manifest.json", "w") as manifest_file:
+            json.dump({"tsv_path": self.tsv_path, "records": self.lines_processed, "files": manifest},
+                      manifest_file, indent=2)
+
+    def __scan_shards(self):
+        """Find byte ranges of the tsv holding records_per_file rows each.
+
+        returns:
+        (list) start offset, end offset and row count of each range.
+        """
+        shards = []
+        with open(self.tsv_path, "rb") as tsv_file:
+            heading_line = tsv_file.readline()
+            self.headings = [h.strip() for h in heading_line.decode("utf-8").split("\t")]
+            start = offset = len(heading_line)
+            rows = 0
+            for line in islice(tsv_file, self.lines_to_process):
+                offset += len(line)
+                rows += 1
+                if rows == self.records_per_file:
+                    shards.append((start, offset, rows))
+                    start = offset
+                    rows = 0
+        # The serial path always writes a final file, even when it is empty.
+        if rows or not shards:
+            shards.append((start, offset, rows))
+        return shards
+
+    def _build_rdf_file(self, rows, output_path, headings):
+        """Build RDF for rows and write them to a single file.
 
-    def __write_rdf(self):
-        """Write all RDF processed up to the current line."""
-        if self.file_count > 0:
+        args:
+        rows (list) -- dicts of values from lines of the tsv file, keyed by heading.
+        output_path (str) -- path of the file to write.
+        headings (list) -- column names from the tsv file.
+        returns:
+        (int) number of records written.
+        """
+        self.__compile_plan(headings)
+        rdf_writer = RdfFileWriter(output_path, self.ns_map)
+        for row in rows:
+            self.line_reference = row
+            rdf_writer.write(self.__create_rdf())
+        rdf_writer.close()
+        return rdf_writer.records_written
+
+    def __shard_path(self, file_count):
+        """Return path of the output file with the given index."""
+        if file_count > 0:
             output_parts = os.path.splitext(self.output_path)
-            output_path = output_parts[0] + "_{0}".format(self.file_count) + output_parts[1]
-        else:
-            output_path = self.output_path
-
-        with codecs.open(output_path, "w", "utf-8") as output_file:
-            output_file.write(etree.tostring(self.rdf_root, encoding="unicode", pretty_print=True))
+            return output_parts[0] + "_{0}".format(file_count) + output_parts[1]
+        return self.output_path
 
+    def __write_rdf(self):
+        """Finish the file holding all RDF processed up to the current line."""
+        self.rdf_writer.close()
         self.file_count += 1
         self.__set_rdf_root()
 
-    def __process_line(self, line):
+    def __process_line(self, row):
         """Process individual line of tsv file.
 
         args:
-        line (str) -- single line from tsv file.
+        row (dict) -- values from a single line of the tsv file, keyed by heading.
         """
-        self.line_data = line.split("\t")
-        self.line_reference = {}
-        self.line_reference.update(zip(self.headings, self.line_data))
+        self.line_reference = row
 
         if self.lines_processed % self.records_per_file == 0 and self.lines_processed != 0:
             self.__write_rdf()
@@ -120,74 +320,111 @@ class BuildRdf():
 
     def __create_rdf(self):
         """Start RDF creation."""
-
-        self.ns_map = {
-            "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
-            "role": "http://www.loc.gov/loc.terms/relators/",
-            "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
-            "collex": "http://www.collex.org/schema#",
-            "dcterms": "http://purl.org/dc/terms/",
-            "dc": "http://purl.org/dc/elements/1.1/",
-            "sro": "http://www.lib.msu.edu/sro/schema#",
-        }
-
         # self.rdf_root = etree.Element("{{{0}}}RDF".format(self.ns_map["rdf"]), nsmap=self.ns_map)
         return self.__process_elements()
 
-    def __process_elements(self):
-        """Process data into RDF."""
+    def __compile_plan(self, headings):
+        """Choose the steps that build each record, once per tsv file.
+
+        Qualified names for the wrapper element and its attributes are
+        computed here, and steps are picked based on which columns exist,
+        so the per-row loop in __process_elements only runs the steps.
+
+        args:
+        headings (list) -- column names from the tsv file.
+        """
         # The triple-{} includes a literal "{}" and a {} that operates the format string.
         # That is, one escapes braces in a format string by doubling them.
-        self.siro_wrapper = etree.Element("{{{0}}}{1}".format(self.ns_map["sro"], self.default_values["archive"][0]))
-        siro_wrapper_attribute = "{{{0}}}about".format(self.ns_map["rdf"])
-        self.siro_wrapper.attrib[siro_wrapper_attribute] = self.line_reference["id"]
+        self.wrapper_tag = "{{{0}}}{1}".format(self.ns_map["sro"], self.default_values["archive"][0])
+        self.about_attribute = "{{{0}}}about".format(self.ns_map["rdf"])
+        self.resource_attribute = "{{{0}}}resource".format(self.ns_map["rdf"])
+        self.see_also_columns = [column for column in ("seeAlso", "see_also") if column in headings]
+
+        self.plan = [self.__add_federation, self.__add_archives, self.__add_title]
+        if "creator" in headings:
+            self.plan.append(self.__add_creators)
+        elif "creators" in headings:
+            self.plan.append(self.__add_creator_entries)
+        self.plan += [
+            self.__add_source,
+            self.__add_description,
+            self.__add_subjects,
+            self.__add_disciplines,
+            self.__add_genres,
+            self.__add_freecultures,
+            self.__add_type,
+            self.__add_date,
+            self.__add_fulltext,
+            self.__add_language,
+            self.__add_see_also,
+            self.__add_images,
+        ]
+
+    def __process_elements(self):
+        """Process data into RDF by running each step of the plan."""
+        self.siro_wrapper = etree.Element(self.wrapper_tag)
+        self.siro_wrapper.attrib[self.about_attribute] = self.line_reference["id"]
+        self.is_letter = LETTER_PATTERN.search(self.line_reference["title"]) is not None
+        for step in self.plan:
+            step()
+        return self.siro_wrapper
+        """
+        with codecs.open("rdf/20170616/{0}.xml".format(os.path.basename(self.line_reference["id"])), "w", "utf-8") as output_file:
+            output_file.write(etree.tostring(self.rdf_root, encoding="unicode", pretty_print=True))
+        """
+
+    def __add_federation(self):
         self.__add_subelement(self.siro_wrapper, "federation", "collex", field_value="SiRO")
 
+    def __add_archives(self):
         for value in self.__get_values("archive"):
             self.__add_subelement(self.siro_wrapper, "archive", "collex", field_value=value)
 
+    def __add_title(self):
         self.__add_subelement(self.siro_wrapper, "title", "dc", field_value=self.line_reference["title"])
-        self.__add_creators()
+
+    def __add_source(self):
         self.__add_subelement(self.siro_wrapper, "source", "dc", field_value=self.line_reference["source"])
+
+    def __add_description(self):
         if self.line_reference["description"].strip():
             self.__add_subelement(self.siro_wrapper, "description", "dc", field_value=self.line_reference["description"])
+
+    def __add_subjects(self):
         for subject in self.line_reference["subjects"].split("|"):
             self.__add_subelement(self.siro_wrapper, "subject", "dc", field_value=subject.strip())
 
+    def __add_disciplines(self):
         for value in self.__get_values("discipline"):
             self.__add_subelement(self.siro_wrapper, "discipline", "collex", field_value=value)
 
-        self.__add_genres()
-        self.__add_freecultures()
-        self.__add_type()
-        self.__add_date()
-
+    def __add_fulltext(self):
         self.__add_subelement(self.siro_wrapper, "fulltext", "collex", field_value="TRUE")
+
+    def __add_language(self):
         if self.line_reference["language"].strip():
             self.__add_subelement(self.siro_wrapper, "language", "dc", field_value=self.line_reference["language"])
 
-        if self.line_reference.get("seeAlso", "").strip():
-            object_link = self.line_reference["seeAlso"].strip()
-        elif self.line_reference["see_also"].strip():
-            object_link = self.line_reference["see_also"].strip()
+    def __add_see_also(self):
+        """Link to the item from seeAlso (or see_also), falling back to its DPLA page."""
+        for column in self.see_also_columns:
+            if self.line_reference[column].strip():
+                object_link = self.line_reference[column].strip()
+                break
         else:
             object_id = os.path.basename(self.line_reference["id"])
             object_link = "http://dp.la/item/{0}".format(object_id)
 
         self.__add_subelement(
             self.siro_wrapper, "seeAlso", "rdfs",
-            attributes={"{{{0}}}resource".format(self.ns_map["rdf"]): object_link}
+            attributes={self.resource_attribute: object_link}
         )
 
+    def __add_images(self):
         if self.line_reference["thumbnail"].strip():
-            self.__add_subelement(self.siro_wrapper, "thumbnail", "collex", attributes={"{{{0}}}resource".format(self.ns_map["rdf"]): self.line_reference["thumbnail"]})
-        if self.line_reference["image"].strip():
-            self.__add_subelement(self.siro_wrapper, "image", "collex", attributes={"{{{0}}}resource".format(self.ns_map["rdf"]): self.line_reference["image"]})
-        return self.siro_wrapper
-        """
-        with codecs.open("rdf/20170616/{0}.xml".format(os.path.basename(self.line_reference["id"])), "w", "utf-8") as output_file:
-            output_file.write(etree.tostring(self.rdf_root, encoding="unicode", pretty_print=True))
-        """
+            self.__add_subelement(self.siro_wrapper, "thumbnail", "collex", attributes={self.resource_attribute: self.line_reference["thumbnail"]})
+        if self.line_reference.get("image", "").strip():
+            self.__add_subelement(self.siro_wrapper, "image", "collex", attributes={self.resource_attribute: self.line_reference["image"]})
 
     def __get_values(self, field):
         """
@@ -204,20 +441,22 @@ class BuildRdf():
 
     def __add_creators(self):
         """Bring together roles and creators."""
-        if "creator" in self.line_reference:
-
-            if self.line_reference["creator"].strip():
-                self.creators = self.line_reference["creator"].split("|")
-            else:
-                self.creators = ["Unknown"]
-            self.role_type = self.__get_role()
-            creator_roles = zip(self.role_type, self.creators)
-        elif "creators" in self.line_reference:
-            creator_roles = []
-            for creator_entry in self.line_reference["creators"].split("|"):
-                creator, role = creator_entry.split(":")
-                creator_roles.append((role.strip(), creator.strip()))
-
+        if self.line_reference["creator"].strip():
+            self.creators = self.line_reference["creator"].split("|")
+        else:
+            self.creators = ["Unknown"]
+        self.role_type = self.__get_role()
+        self.__add_creator_roles(zip(self.role_type, self.creators))
+
+    def __add_creator_entries(self):
+        """Add creators from a "creators" column of "|"-separated "creator: role" entries."""
+        creator_roles = []
+        for creator_entry in self.line_reference["creators"].split("|"):
+            creator, role = creator_entry.split(":")
+            creator_roles.append((role.strip(), creator.strip()))
+        self.__add_creator_roles(creator_roles)
+
+    def __add_creator_roles(self, creator_roles):
         for creator in creator_roles:
             self.__add_subelement(self.siro_wrapper, creator[0], "role", field_value=creator[1].strip())
 
@@ -228,8 +467,7 @@ class BuildRdf():
         else:
             self.genres = [g.title() for g in self.line_reference["genre"].split("|")]
 
-        self.letter_pattern = r'\[.*[Ll]etter.*\]'
-        if re.search(self.letter_pattern, self.line_reference["title"]):
+        if self.is_letter:
             self.genres.append("Correspondence")
 
         if len(self.genres) == 0:
@@ -241,14 +479,13 @@ class BuildRdf():
     def __add_type(self):
         """Find 1 type for each item."""
 
-        manuscript_pattern = r'\[.*[Mm]anuscript.*\]'
-        if re.search(manuscript_pattern, self.line_reference["title"]):
+        if MANUSCRIPT_PATTERN.search(self.line_reference["title"]):
             record_type = "Manuscript"
 
         elif self.line_reference["type"] == "image":
             record_type = "Still Image"
 
-        elif self.line_reference["type"] == "text" and re.search(self.letter_pattern, self.line_reference["title"]):
+        elif self.line_reference["type"] == "text" and self.is_letter:
             record_type = "Manuscript"
 
         elif self.line_reference["type"] == "text":
@@ -278,9 +515,9 @@ class BuildRdf():
             date = date.split("|")[0]
         dcdate = None
 
-        matches = re.findall(r'[0-9]{4}', date)
+        matches = YEAR_PATTERN.findall(date)
 
-        if re.search(r'^[0-9]{4}$', date):
+        if YEAR_ONLY_PATTERN.search(date):
             dcdate = date
 
         elif matches:
@@ -320,10 +557,16 @@ class BuildRdf():
             return [role.strip() for role in self.line_reference["role"].split("|")]
 
     def __add_subelement(self, parent, tag_name, prefix, field_value=None, attributes=None):
-        """
+        """Add child element, stripping surrounding quotes from its text.
 
+        Qualified tag names are computed once per (prefix, tag_name) and reused.
         """
-        subelement = etree.SubElement(parent, "{{{0}}}{1}".format(self.ns_map[prefix], tag_name))
+        try:
+            qualified_name = self.qualified_names[(prefix, tag_name)]
+        except KeyError:
+            qualified_name = "{{{0}}}{1}".format(self.ns_map[prefix], tag_name)
+            self.qualified_names[(prefix, tag_name)] = qualified_name
+        subelement = etree.SubElement(parent, qualified_name)
         if attributes is not None:
             for key, value in attributes.items():
                 subelement.attrib[key] = value
@@ -0,0 +1,140 @@
+"""Export metadata records to columnar Parquet or Arrow IPC files.
+
+Requires pyarrow, which is only imported when a columnar file is written or read.
+"""
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Multi-valued fields, stored as list<string> columns rather than " | "-joined text.
+LIST_COLUMNS = ["subjects", "creator", "language", "type", "original_query"]
+
+
+def _require_pyarrow():
+    """Raise a helpful error if pyarrow is not installed."""
+    if pa is None:
+        raise ImportError("pyarrow is required for Parquet/Arrow export: pip install pyarrow")
+
+
+def _text(value):
+    """Return value as text, JSON-encoding anything that is not already a string."""
+    if isinstance(value, basestring):
+        return value
+    return json.dumps(value)
+
+
+class ColumnarWriter(object):
+    """Write records to a Parquet or Arrow IPC file in batches.
+
+    List fields keep their values as native list columns, and every other
+    field is stored as a string column.
+    """
+
+    def __init__(self, output_path, columns, list_columns=LIST_COLUMNS, file_format="parquet",
+                 batch_size=10000):
+        """Open output file.
+
+        args:
+            output_path(str): path of the file to write.
+            columns(list): field names, in output order.
+        kwargs:
+            list_columns(list): fields stored as list<string>.
+            file_format(str): either 'parquet' or 'arrow' (Arrow IPC file format,
+                which can be memory-mapped for zero-copy reads).
+            batch_size(int): records buffered per row group / record batch.
+        """
+        _require_pyarrow()
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError("Invalid file_format: {0}".format(file_format))
+        self.columns = columns
+        self.list_columns = set(list_columns)
+        self.batch_size = batch_size
+        self.schema = pa.schema([
+            pa.field(column, pa.list_(pa.string()) if column in self.list_columns else pa.string())
+            for column in columns
+        ])
+        if file_format == "parquet":
+            self.writer = pq.ParquetWriter(output_path, self.schema)
+        else:
+            self.sink = pa.OSFile(output_path, "wb")
+            self.writer = pa.RecordBatchFileWriter(self.sink, self.schema)
+        self.file_format = file_format
+        self.records_written = 0
+        self.__reset_batch()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        """Add one record, writing a batch once batch_size records are buffered.
+
+        args:
+            record(dict): metadata record, e.g. from DplaApi.iter_arc_records.
+        """
+        for column in self.columns:
+            value = record.get(column)
+            if column in self.list_columns:
+                if value is None or value == "":
+                    value = []
+                elif not isinstance(value, list):
+                    value = [value]
+                value = [_text(v) for v in value if v is not None]
+            elif isinstance(value, list):
+                value = u" | ".join([_text(v) for v in value if v is not None])
+            elif value is not None:
+                value = _text(value)
+            self.batch[column].append(value)
+        self.batch_records += 1
+        self.records_written += 1
+        if self.batch_records >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records as one batch."""
+        if self.batch_records:
+            arrays = [pa.array(self.batch[column], type=self.schema.field(column).type)
+                      for column in self.columns]
+            batch = pa.RecordBatch.from_arrays(arrays, self.columns)
+            if self.file_format == "parquet":
+                self.writer.write_table(pa.Table.from_batches([batch], schema=self.schema))
+            else:
+                self.writer.write_batch(batch)
+            self.__reset_batch()
+
+    def close(self):
+        """Write remaining records and close the file."""
+        self.flush()
+        self.writer.close()
+        if self.file_format == "arrow":
+            self.sink.close()
+
+    def __reset_batch(self):
+        """Start a new, empty batch."""
+        self.batch = dict((column, []) for column in self.columns)
+        self.batch_records = 0
+
+
+def read_columnar(path, memory_map=True):
+    """Load a Parquet or Arrow IPC file written by ColumnarWriter as a pyarrow Table.
+
+    Arrow IPC files are memory-mapped and read without copying. Use
+    Table.to_pandas() for analysis in pandas.
+
+    args:
+        path(str): path of the file; ".arrow" and ".feather" files are read as Arrow IPC.
+    kwargs:
+        memory_map(bool): memory-map the file rather than reading it into memory.
+    """
+    _require_pyarrow()
+    if path.endswith((".arrow", ".feather")):
+        source = pa.memory_map(path, "r") if memory_map else pa.OSFile(path, "rb")
+        return pa.RecordBatchFileReader(source).read_all()
+    return pq.read_table(path, memory_map=memory_map)
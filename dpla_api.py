@@ -1,13 +1,23 @@
 """Access DPLA api and work with data."""
 from __future__ import division
-from dpla.api import DPLA
-from lxml import etree
 import ConfigParser
-from metadpla import DplaMetadata
+import fastjson
+from metadpla import DplaMetadata, share
+from buildrdf import BuildRdf
+from columnar import ColumnarWriter
+from dpla_client import AsyncDplaClient
 from hathi import HathiBibApi
-import codecs
-import time
-import json
+from item_store import ItemStore
+from marcxml import MarcXmlExporter
+from metrics import PipelineMetrics
+from genres import GenreEnricher, extract_genre
+from registry import MatchRegistry
+from response_cache import ResponseCache
+from throttle import TokenBucket
+from tsvwriter import TsvWriter
+from multiprocessing.pool import ThreadPool
+from collections import deque
+from itertools import islice
 import math
 import os
 
@@ -15,112 +25,452 @@ import os
 class DplaApi():
     """Interact with DPLA API using pre-acquired key."""
 
+    # Item-level fields read by __process_metadata and the match registry.
+    item_fields = ["@id", "object", "isShownAt", "provider.name", "dataProvider"]
+
+    # Columns of the pre-RDF TSV file, in order.
+    tsv_columns = ["discipline", "federation", "language", "creator", "id", "title", "archive", "genre",
+                   "original_query", "subjects", "date", "type", "thumbnail", "seeAlso", "source",
+                   "description", "role", "image"]
+
+    # Values of the MARC 008 'literary form' byte, mapped to ARC genres.
+    genre_map = {"0": "Nonfiction",
+                 "1": "Fiction",
+                 "d": "Drama",
+                 "e": "Nonfiction",
+                 "f": "Fiction",
+                 "i": "Correspondence",
+                 "j": "Fiction",
+                 "p": "Poetry"
+                 }
+
     def __init__(self):
         """Load DPLA key and establish connection."""
         self.dpla_key = self.__load_dpla_key()
-        self.dpla = DPLA(self.dpla_key)
         self.result = None
         self.metadata_records = []
-
-    def search(self, q_value, page_size=100, fields=[]):
+        self.item_store = ItemStore()
+        self.registry = None
+        self.hathi_api = None
+        self.genre_enricher = None
+        self.hathi_settings = self.__load_hathi_settings()
+        self.search_workers, requests_per_second, self.project_fields = self.__load_search_settings()
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.response_cache = self.__load_cache_settings()
+        self.json_decoder = fastjson.set_decoder(self.__load_json_settings())
+        self.metrics_settings = self.__load_metrics_settings()
+        self.metrics = PipelineMetrics(profile_dir=self.metrics_settings["profile_dir"])
+        self.client = AsyncDplaClient(self.dpla_key, workers=self.search_workers, metrics=self.metrics,
+                                      rate_limiter=self.rate_limiter, **self.__load_client_settings())
+
+    def search(self, q_value, page_size=100, fields=[], workers=None, project=None):
         """Run basic search query across DPLA.
 
+        Results are stored in self.all_returned_items; use iter_search to
+        process them one page at a time instead.
+
         args:
             q_value (str) -- value to search
         kwargs:
             page_size (int) -- max number of results to request from DPLA.
             (DPLA-imposed limit is 500)
+            workers (int) -- number of threads used to fetch pages 2..N
+            concurrently. Defaults to the [search] setting in default.cfg;
+            1 fetches pages serially.
+            fields (list) -- fields to request for each item, on every page.
+            project (bool) -- when no fields are given, request only the fields
+            used to build ARC records (see projection_fields). Defaults to the
+            [search] setting in default.cfg.
+        """
+        with self.metrics.profile("search"):
+            self.all_returned_items = list(self.iter_search(q_value, page_size=page_size, fields=fields,
+                                                            workers=workers, project=project))
+
+    def iter_search(self, q_value, page_size=100, fields=[], workers=None, project=None):
+        """Run search query across DPLA, yielding items page by page.
+
+        Only the pages currently being fetched are held in memory.
+
+        args:
+            q_value (str) -- value to search
+        kwargs:
+            page_size (int) -- max number of results to request from DPLA.
+            workers (int) -- number of threads used to fetch pages 2..N
+            concurrently.
+            fields (list) -- fields to request for each item, on every page.
+            project (bool) -- when no fields are given, request only the fields
+            used to build ARC records.
         """
-        if isinstance(q_value, str):
-            self.query = q_value.strip().replace(",", "").replace("(", "").replace(")", "")
-            self.result = self.dpla.search(q=q_value, page_size=page_size)
-        elif isinstance(q_value, dict):
-            self.query = q_value
-            self.result = self.dpla.search(searchFields=q_value, page_size=page_size, fields=fields)
+        fields = self._resolve_fields(fields, project)
+        self.query = self._query_label(q_value)
+        self.result = self._search_page(q_value, page_size, 1, fields=fields)
 
         print "Query: '{0}' returned {1} results".format(self.query, self.result.count)
-        time.sleep(.5)
-        self.all_returned_items = self.result.items
+        for item in self.result.items:
+            yield item
         if self.result.count > self.result.limit:
             pages = int(math.ceil(self.result.count / self.result.limit))
-            for page in range(2, pages + 1):
+            for page, result in self._fetch_pages(q_value, page_size, range(2, pages + 1), workers, fields):
                 print "----Accessing results page {0}".format(page)
-                self.result = self.dpla.search(q=q_value, page_size=page_size, page=page)
-                self.all_returned_items += self.result.items
-                time.sleep(.5)
+                self.result = result
+                for item in self.result.items:
+                    yield item
+
+    def _query_label(self, q_value):
+        """Return the query as recorded in each record's "original_query" field.
+
+        args:
+            q_value (str or dict) -- value to search, or dict of searchFields.
+        """
+        if isinstance(q_value, basestring):
+            return q_value.strip().replace(",", "").replace("(", "").replace(")", "")
+        return q_value
+
+    def projection_fields(self):
+        """Return the minimum list of fields needed to build ARC records."""
+        return self.item_fields + ["sourceResource." + field for field in DplaMetadata.source_fields]
 
-    def build_arc_rdf_dataset(self, check_match=True, disciplines="", id_match=None):
+    def _resolve_fields(self, fields, project=None):
+        """Return fields to request on every page of a search.
+
+        args:
+            fields (list) -- fields requested by the caller.
+        kwargs:
+            project (bool) -- use projection_fields when no fields are given.
+        """
+        if project is None:
+            project = self.project_fields
+        if not fields and project:
+            return self.projection_fields()
+        return fields
+
+    def _search_page(self, q_value, page_size, page, fields=[]):
+        """Request a single page of results.
+
+        The client takes a token from the shared rate limiter before every
+        attempt, including retries.
+
+        args:
+            q_value (str or dict) -- value to search, or dict of searchFields.
+            page_size (int) -- number of results per page.
+            page (int) -- page of results to request.
+        kwargs:
+            fields (list) -- fields to request for each item.
+
+        Pages found in the response cache are returned without a request.
+        """
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(q_value, page, page_size, fields)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.metrics.add("cache", self._query_label(q_value), items=len(cached.items))
+                return cached
+
+        result = self._request_page(q_value, page_size, page, fields)
+        if fields:
+            result.items = [self._expand_fields(item) for item in result.items]
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, result)
+        return result
+
+    def _request_page(self, q_value, page_size, page, fields=[]):
+        """Request a page of results from the DPLA API through the client.
+
+        Transient failures are retried by the client, so one failed request
+        does not abort a search; see the [search] settings in default.cfg.
+
+        args:
+            q_value (str or dict) -- value to search, or dict of searchFields.
+            page_size (int) -- number of results per page.
+            page (int) -- page of results to request.
+        kwargs:
+            fields (list) -- fields to request for each item.
+        """
+        return self.client.search_page(q_value, page_size=page_size, page=page, fields=fields,
+                                       label=self._query_label(q_value))
+
+    def _expand_fields(self, item):
+        """Nest the dotted keys DPLA returns for requested fields.
+
+        e.g. {"sourceResource.title": "..."} becomes {"sourceResource": {"title": "..."}},
+        matching the shape of a full item.
+
+        args:
+            item (dict) -- item from a search that requested specific fields.
+        """
+        expanded = {}
+        for key, value in item.items():
+            parts = key.split(".")
+            target = expanded
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        return expanded
+
+    def _fetch_pages(self, q_value, page_size, pages, workers=None, fields=[]):
+        """Fetch pages of results, yielding (page, result) tuples in page order.
+
+        At most `workers` pages are requested ahead of the page being yielded.
+
+        args:
+            q_value (str or dict) -- value to search.
+            page_size (int) -- number of results per page.
+            pages (list) -- page numbers to request.
+        kwargs:
+            workers (int) -- size of the thread pool; 1 fetches serially.
+            fields (list) -- fields to request for each item.
+        """
+        if workers is None:
+            workers = self.search_workers
+        if workers > 1 and len(pages) > 1:
+            self.client.ensure_connections(min(workers, len(pages)))
+            pool = ThreadPool(min(workers, len(pages)))
+            pages = iter(pages)
+            in_flight = deque()
+            try:
+                for page in islice(pages, workers):
+                    in_flight.append((page, pool.apply_async(self._search_page, (q_value, page_size, page, fields))))
+                while in_flight:
+                    page, result = in_flight.popleft()
+                    for next_page in islice(pages, 1):
+                        in_flight.append((next_page, pool.apply_async(self._search_page,
+                                                                      (q_value, page_size, next_page, fields))))
+                    yield page, result.get()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for page in pages:
+                yield page, self._search_page(q_value, page_size, page, fields)
+
+    def build_arc_rdf_dataset(self, check_match=True, disciplines="", id_match=None, items=None,
+                              enrich_genres=None, merge_queries=True):
         """Iterate over search results and pull necessary elements to create ARC RDF.
 
         Store results in a list of python dictionaries.
         kwargs:
             check_match(bool): check if RDF for item has already been created.
             disciplines(str): string of "|"-separated values.
+            items(iterable): items to process, e.g. from iter_search. By default,
+                the items returned by the last call to search.
+            enrich_genres(bool): look up genres in HathiTrust MARC records.
+                Defaults to the [hathi] setting in default.cfg.
+            merge_queries(bool): keep one record per item across searches (see
+                item_store). An item returned again has the current query added to
+                the "original_query" list of its existing record.
+        """
+        if items is None:
+            items = self.all_returned_items
+        transferred = len(self.metadata_records)
+        item_store = self.item_store if merge_queries else None
+        with self.metrics.profile("build_arc_rdf_dataset"):
+            self.metadata_records.extend(self.iter_arc_records(items, check_match=check_match,
+                                                               disciplines=disciplines, id_match=id_match,
+                                                               enrich_genres=enrich_genres,
+                                                               item_store=item_store))
+        print "----Check: {0} records transferred"\
+              .format(len(self.metadata_records) - transferred)
+
+    def iter_arc_records(self, items, check_match=True, disciplines="", id_match=None,
+                         enrich_genres=None, chunk_size=500, item_store=None, new_ids=None):
+        """Yield ARC metadata records for DPLA items as they are processed.
+
+        Items are handled in chunks, so genre lookups for a chunk's
+        HathiTrust items can be made together.
+
+        args:
+            items(iterable): DPLA items, e.g. from iter_search.
+        kwargs:
+            check_match(bool): check if RDF for item has already been created.
+            disciplines(str): string of "|"-separated values.
+            enrich_genres(bool): look up genres in HathiTrust MARC records.
+                Defaults to the [hathi] setting in default.cfg.
+            chunk_size(int): number of items processed together.
+            item_store(ItemStore): records of items returned by earlier queries.
+                Items already in the store are not compiled again; the current
+                query and disciplines are merged into their stored record.
+                New records are added to the store.
+            new_ids(list): if given, the ids of new items are appended to it
+                instead of being added to the registry, so the caller can
+                register them once their records are safely stored.
         """
         self.disciplines = disciplines
         self.id_match = id_match
+        if enrich_genres is None:
+            enrich_genres = self.hathi_settings["enrich_genres"]
         if check_match:
             self.__load_match_data()
 
-        print "----Check: {0} records transferred"\
-              .format(len(self.all_returned_items))
         rdf_matches = 0
         new_records = 0
-        for item in self.all_returned_items:
-            if check_match:
-                if os.path.basename(item["@id"]) in self.existing_records:
-                    rdf_matches += 1
-                else:
-                    self.__process_metadata(item)
-                    self.existing_records.append(item["@id"])
-                    new_records += 1
-
-            else:
-                self.__process_metadata(item)
+        unregistered = set()
+        items = iter(items)
+        chunk = list(islice(items, chunk_size))
+        while chunk:
+            new_items = []
+            with self.metrics.stage("registry", self.query, items=len(chunk)):
+                chunk_ids = set()
+                for item in chunk:
+                    if item_store is not None:
+                        if item["@id"] in item_store:
+                            item_store.merge(item["@id"], self.query, disciplines)
+                            continue
+                        if item["@id"] in chunk_ids:
+                            continue
+                        chunk_ids.add(item["@id"])
+                    if check_match:
+                        if item["@id"] in self.registry or item["@id"] in unregistered:
+                            rdf_matches += 1
+                            continue
+                        if new_ids is None:
+                            self.registry.add(item["@id"])
+                        else:
+                            new_ids.append(item["@id"])
+                            unregistered.add(item["@id"])
+                        new_records += 1
+                    new_items.append(item)
+
+            genres = {}
+            if enrich_genres:
+                with self.metrics.stage("genres", self.query, items=len(new_items)):
+                    genres = self._get_genres_from_marc(new_items)
+            records = []
+            with self.metrics.stage("compile", self.query, items=len(new_items)):
+                compiled = DplaMetadata.batch_records(
+                    DplaMetadata.compile_batch([item.get("sourceResource", {}) for item in new_items]))
+                for item, record in zip(new_items, compiled):
+                    record = self.__process_metadata(item, record)
+                    if record is not None:
+                        if item["@id"] in genres:
+                            record["genre"] = genres[item["@id"]]
+                        if item_store is not None:
+                            item_store.add(record)
+                        records.append(record)
+            for record in records:
+                yield record
+            chunk = list(islice(items, chunk_size))
 
         # print "----Found: {0} existing RDF records".format(rdf_matches)
         # print "----Saved: {0} new metadata records".format(new_records)
-        self.__load_match_data(reset_match_file=True)
-        self._store_match_data()
+        if check_match:
+            self._store_match_data()
 
     def create_tsv(self, records=None,
-                   output_path="data/radicalism-dpla.tsv"):
+                   output_path="data/radicalism-dpla.tsv", append=False):
         """Build TSV file for ARC pre-RDF dataset.
 
+        Records are written as they are read, so a generator such as
+        iter_arc_records can be passed without holding every record in memory.
+        Columns always follow tsv_columns.
+
         kwargs:
-            records(list): by default, the results created from the current search.
+            records(iterable): by default, the results created from the current search.
+            append(bool): add rows to an existing TSV file instead of replacing it.
         """
-        if not records:
+        if records is None:
             records = self.metadata_records
-        tsv_lines = []
-        headings = "\t".join(records[0].keys())
-        headings += "\n"
-        lists = 0
-        tsv_lines.append(headings)
-        for record in records:
-            line = ""
-            for key, value in record.items():
-                if isinstance(value, list):
-                    if any(isinstance(v, list) for v in value):
-                        lists += 1
-                    else:
-                        line += " | ".join([v.replace("\t", " ") for v in value if v is not None])
-                elif isinstance(value, str):
-                    line += value.replace("\t", " ")
-                else:
-                    value_str = json.dumps(value)
-                    line += value_str
-                line += "\t"
-            line += "\n"
-            tsv_lines.append(line)
+        start_size = os.path.getsize(output_path) if append and os.path.exists(output_path) else 0
+        with self.metrics.profile("create_tsv"):
+            with TsvWriter(output_path, self.tsv_columns, append=append) as tsv_writer:
+                for record in self.metrics.consumer("tsv", records):
+                    tsv_writer.write(record)
+        self.metrics.add("tsv", calls=0, bytes=os.path.getsize(output_path) - start_size)
 
-        with codecs.open(output_path, "w", "UTF-8") as output_file:
-            for line in tsv_lines:
-                output_file.write(line)
+        print "Completed writing {0} records to {1}".format(tsv_writer.records_written, output_path)
 
-        print "Completed writing {0}".format(output_path)
+    def create_columnar(self, records=None, output_path="data/radicalism-dpla.parquet"):
+        """Write records to a Parquet or Arrow IPC file for analysis.
 
-    def update_rdf_registry(self, rdf_dir="rdf", reset_matches=False):
+        Multi-valued fields (subjects, creator, language, type,
+        original_query) are kept as list columns. Files ending in ".arrow" or
+        ".feather" are written in Arrow IPC format, which
+        columnar.read_columnar memory-maps; others are written as Parquet.
+        Requires pyarrow.
+
+        kwargs:
+            records(iterable): by default, the results created from the current search.
+        """
+        if records is None:
+            records = self.metadata_records
+        file_format = "arrow" if output_path.endswith((".arrow", ".feather")) else "parquet"
+        with ColumnarWriter(output_path, self.tsv_columns, file_format=file_format) as columnar_writer:
+            for record in self.metrics.consumer("columnar", records):
+                columnar_writer.write(record)
+
+        print "Completed writing {0} records to {1}".format(columnar_writer.records_written, output_path)
+
+    def create_rdf(self, records=None, output_path="rdf/dpla.xml", records_per_file=500, archive="dpla"):
+        """Build ARC RDF files directly from metadata records, skipping the TSV file.
+
+        Use this for fully automated runs; create_tsv remains the route for
+        datasets that need manual editing before conversion.
+
+        kwargs:
+            records(iterable): by default, the results created from the current search.
+            output_path(str): path of the first RDF file; later files are numbered.
+            records_per_file(int): number of records in each RDF file.
+            archive(str): archive name used for the record wrapper element.
+        """
+        if records is None:
+            records = self.metadata_records
+        with self.metrics.profile("create_rdf"):
+            BuildRdf(archive=archive).build_rdf_from_records(self.metrics.consumer("rdf", records), output_path,
+                                                              records_per_file=records_per_file)
+
+    def export_marcxml(self, items=None, output_path="data/marcxml/dpla.xml", records_per_file=10000,
+                       processes=None):
+        """Write the MARC records in items' originalRecord payloads to MARCXML collection files.
+
+        Records in both the "marc:"-prefixed and the plain layout are
+        converted, and each file holds records_per_file <record> elements.
+        Items searched with project_fields have no originalRecord, so search
+        with project=False for the items to export.
+
+        kwargs:
+            items(iterable): items to export, e.g. from iter_search(..., project=False).
+                By default, the items returned by the last call to search.
+            output_path(str): path of the first file; later files are numbered.
+            records_per_file(int): number of records in each file.
+            processes(int): size of the process pool used to convert records;
+                by default they are converted in this process.
+        returns:
+            (dict) converted records and errors for each layout.
+        """
+        if items is None:
+            items = self.all_returned_items
+        exporter = MarcXmlExporter(output_path, records_per_file=records_per_file, processes=processes)
+        missing = []
+        counts = exporter.export(self.metrics.consumer("marcxml", self.__note_missing_original(items, missing)))
+        if missing:
+            print "----Warning: {0} items have no originalRecord; search with project=False to export them"\
+                  .format(len(missing))
+        print "{0} MARCXML Records Written to {1} Files".format(
+            sum(layout_counts["records"] for layout_counts in counts.values()), len(exporter.files))
+        print "{0} MARC Namespace Records ({1} Errors)".format(counts["marc"]["records"], counts["marc"]["errors"])
+        print "{0} Plain Records ({1} Errors)".format(counts["plain"]["records"], counts["plain"]["errors"])
+        print "{0} Non Standard Records".format(counts["non_standard"]["errors"])
+        return counts
+
+    def __note_missing_original(self, items, missing):
+        """Yield items, appending the ids of those without an originalRecord to missing."""
+        for item in items:
+            if "originalRecord" not in item:
+                missing.append(item.get("@id"))
+            yield item
+
+    def export_metrics(self):
+        """Write pipeline metrics to the JSON log and Prometheus textfile set in default.cfg.
+
+        returns:
+            (dict) snapshot of the metrics, by stage and query.
+        """
+        if self.metrics_settings["json_log"]:
+            self.metrics.write_json(self.metrics_settings["json_log"])
+        if self.metrics_settings["prometheus_file"]:
+            self.metrics.write_prometheus(self.metrics_settings["prometheus_file"])
+        return self.metrics.snapshot()
+
+    def update_rdf_registry(self, rdf_dir="rdf", reset_matches=False, incremental=True):
         """Update listings of already-processed items.
 
         kwargs:
@@ -128,27 +478,27 @@ class DplaApi():
             reset_matches(bool): reset match list and rebuild from scratch,
                 based entirely on RDF files present in specified dir. Any
                 records added to the registry through querying will be removed.
+            incremental(bool): only rescan directories changed since the
+                last scan. Ignored when reset_matches is set.
         """
         self.__load_match_data(reset_match_file=reset_matches)
-        update_count = 0
-        match_count = 0
-        for root, dirs, files in os.walk(rdf_dir):
-            for f in files:
-                if f.endswith(".xml"):
-                    root_name = os.path.splitext(f)[0]
-                    if root_name not in self.existing_records:
-                        self.existing_records.append(root_name)
-                        update_count += 1
-                    else:
-                        match_count += 1
+        update_count, match_count = self.registry.scan_rdf_dir(
+            rdf_dir, incremental=incremental and not reset_matches)
         print "Matching records: {0}".format(match_count)
         print "New records: {0}".format(update_count)
-        self._store_match_data()
+        if reset_matches:
+            self.registry.compact()
+        else:
+            self._store_match_data()
+
+    def compact_registry(self):
+        """Fold ids appended since the last snapshot into the match file."""
+        self.__load_match_data()
+        self.registry.compact()
 
     def _store_match_data(self):
-        """Store updated processed item list."""
-        with open(self.match_file, "w") as match_file:
-            json.dump(self.existing_records, match_file)
+        """Append newly processed items to the registry log."""
+        self.registry.flush()
 
     def __load_dpla_key(self):
         """Load DPLA API Key from config file."""
@@ -156,13 +506,86 @@ class DplaApi():
         config.read("default.cfg")
         return config.get("dpla_api", "api_key")
 
+    def __load_search_settings(self):
+        """Load thread pool size, request rate limit and field projection for searches."""
+        config = ConfigParser.RawConfigParser()
+        config.read("default.cfg")
+        workers = 1
+        requests_per_second = 2
+        project_fields = False
+        if config.has_option("search", "workers"):
+            workers = config.getint("search", "workers")
+        if config.has_option("search", "requests_per_second"):
+            requests_per_second = config.getfloat("search", "requests_per_second")
+        if config.has_option("search", "project_fields"):
+            project_fields = config.getboolean("search", "project_fields")
+        return workers, requests_per_second, project_fields
+
+    def __load_client_settings(self):
+        """Load timeouts and retry settings for search requests."""
+        config = ConfigParser.RawConfigParser()
+        config.read("default.cfg")
+        client_settings = {}
+        for option in ("timeout", "connect_timeout", "backoff", "backoff_max"):
+            if config.has_option("search", option):
+                client_settings[option] = config.getfloat("search", option)
+        if config.has_option("search", "max_retries"):
+            client_settings["max_retries"] = config.getint("search", "max_retries")
+        return client_settings
+
+    def __load_cache_settings(self):
+        """Load response cache settings; returns None if caching is disabled."""
+        config = ConfigParser.RawConfigParser()
+        config.read("default.cfg")
+        if not config.has_section("cache") or not config.getboolean("cache", "enabled"):
+            return None
+        cache_settings = dict(config.items("cache"))
+        return ResponseCache(cache_dir=cache_settings.get("cache_dir", "data/cache"),
+                             ttl=int(cache_settings.get("ttl", 86400)),
+                             max_bytes=int(cache_settings.get("max_bytes", 1024 ** 3)))
+
+    def __load_json_settings(self):
+        """Load name of the JSON decoder; 'auto' picks the fastest one installed."""
+        config = ConfigParser.RawConfigParser()
+        config.read("default.cfg")
+        if config.has_option("json", "decoder"):
+            return config.get("json", "decoder")
+        return "auto"
+
+    def __load_metrics_settings(self):
+        """Load destinations of pipeline metrics and profiles; empty values disable them."""
+        config = ConfigParser.RawConfigParser()
+        config.read("default.cfg")
+        metrics_settings = {"json_log": "", "prometheus_file": "", "profile_dir": ""}
+        for option in metrics_settings:
+            if config.has_option("metrics", option):
+                metrics_settings[option] = config.get("metrics", option)
+        return metrics_settings
+
+    def __load_hathi_settings(self):
+        """Load settings for HathiTrust genre enrichment."""
+        config = ConfigParser.RawConfigParser()
+        config.read("default.cfg")
+        hathi_settings = {"enrich_genres": False, "genre_cache": "data/hathi_genres.tsv", "workers": 4}
+        if config.has_section("hathi"):
+            if config.has_option("hathi", "enrich_genres"):
+                hathi_settings["enrich_genres"] = config.getboolean("hathi", "enrich_genres")
+            if config.has_option("hathi", "genre_cache"):
+                hathi_settings["genre_cache"] = config.get("hathi", "genre_cache")
+            if config.has_option("hathi", "workers"):
+                hathi_settings["workers"] = config.getint("hathi", "workers")
+        return hathi_settings
+
     def __load_match_data(self, reset_match_file=False):
-        """Prepare data on previous search results."""
+        """Prepare data on previous search results.
+
+        The registry is loaded from disk once and reused by later calls.
+        """
         self.match_file = self.__load_match_settings()
+        if self.registry is None or self.registry.match_file != self.match_file:
+            self.registry = MatchRegistry(self.match_file)
         if reset_match_file is True:
-            self.existing_records = []
-        else:
-            self.existing_records = json.load(open(self.match_file, "r"))
+            self.registry.reset()
 
     def __load_match_settings(self):
         """Load file containing list of all previously processed items."""
@@ -170,36 +593,39 @@ class DplaApi():
         config.read("default.cfg")
         return config.get("check_match", "match_file")
 
-    def __process_metadata(self, item):
+    def __process_metadata(self, item, record=None):
         """Process metadata from JSON DPLA record, pulling descriptive
         elements from the 'sourceResource' fields.
 
         Positional arguments:
         item (dict) -- Python dictionary from JSON results of DPLA search.
+        record (MetadataRecord) -- 'sourceResource' fields already compiled,
+            e.g. by DplaMetadata.compile_batch.
+        Returns the compiled record, or None if it does not satisfy id_match.
         """
-        d_metadata = DplaMetadata(item["sourceResource"])
-        d_metadata.compile()
-        d_metadata.record["thumbnail"] = item.get("object", "")
-        d_metadata.record["seeAlso"] = item.get("isShownAt", "")
+        if record is None:
+            d_metadata = DplaMetadata(item.get("sourceResource", {}))
+            d_metadata.compile()
+            record = d_metadata.record
+        record["thumbnail"] = item.get("object", "")
+        record["seeAlso"] = item.get("isShownAt", "")
         if "provider" in item:
-            d_metadata.record["source"] = item["provider"]["name"]
+            record["source"] = share(item["provider"]["name"])
         elif "dataProvider" in item:
-            d_metadata.record["source"] = item["dataProvider"]
-        else:
-            d_metadata.record["source"] = ""
-        d_metadata.record["discipline"] = self.disciplines
-        # d_metadata.record["genre"] = self._get_genre_from_marc(item)
-        d_metadata.record["genre"] = "none"
-        d_metadata.record["archive"] = ""
-        d_metadata.record["role"] = ""
-        d_metadata.record["federation"] = "SiRO"
-        d_metadata.record["original_query"] = self.query
-        d_metadata.record["id"] = item["@id"]
-        if self.id_match:
-            if self.id_match in d_metadata.record["seeAlso"]:
-                self.metadata_records.append(d_metadata.record)
+            record["source"] = share(item["dataProvider"])
         else:
-            self.metadata_records.append(d_metadata.record)
+            record["source"] = ""
+        record["discipline"] = share(self.disciplines)
+        # record["genre"] = self._get_genre_from_marc(item)
+        record["genre"] = "none"
+        record["archive"] = ""
+        record["role"] = ""
+        record["federation"] = "SiRO"
+        record["original_query"] = self.query
+        record["id"] = item["@id"]
+        if self.id_match and self.id_match not in record["seeAlso"]:
+            return None
+        return record
 
     def _get_genre_from_marc(self, item):
         """Check for 'literary form' value in MARC record.
@@ -210,15 +636,6 @@ class DplaApi():
             (str) genre value(s) to include in output.
         """
         genre_value = "none"
-        value_map = {"0": "Nonfiction",
-                     "1": "Fiction",
-                     "d": "Drama",
-                     "e": "Nonfiction",
-                     "f": "Fiction",
-                     "i": "Correspondence",
-                     "j": "Fiction",
-                     "p": "Poetry"
-                     }
         """
         This method could be used with DPLA-returned MARC info, if the spacing
         of the 008 field was preserved.
@@ -226,7 +643,7 @@ class DplaApi():
             for field in item["originalRecord"]["controlfield"]:
                 if field["tag"] == "008" and len(field["#text"]) > 33:
                     genre = field["#text"][33]
-                    genre_value = value_map.get(genre, "")
+                    genre_value = self.genre_map.get(genre, "")
         """
         # Access bibliographic information via the HathiTrust API.
         if "hathitrust" in item.get("isShownAt", ""):
@@ -234,24 +651,50 @@ class DplaApi():
             # print record
             marc_string = record["records"][str(self.hathi_id)]["marc-xml"]
             genre = self._extract_genre(marc_string)
-            genre_value = value_map.get(genre, "")
+            genre_value = self.genre_map.get(genre, "")
 
         return genre_value
 
+    def _get_genres_from_marc(self, items):
+        """Check for 'literary form' values for many items at once.
+
+        HathiTrust records are requested in concurrent multi-id batches rather
+        than one request per item, and genre codes are cached on disk.
+
+        args:
+            items (list): Python dictionaries from JSON results of DPLA search.
+        returns:
+            (dict) genre value for each item, keyed by the item's "@id"; "none"
+            where no genre is known.
+        """
+        genres = dict((item["@id"], "none") for item in items)
+        hathi_items = [item for item in items if "hathitrust" in item.get("isShownAt", "")]
+        codes = self._get_genre_enricher().lookup(self._hathi_record_id(item) for item in hathi_items)
+        for item in hathi_items:
+            hathi_id = self._hathi_record_id(item)
+            if hathi_id in codes:
+                # Records without a usable 008 ("null"), missing records ("") and
+                # unmapped codes keep "none", so BuildRdf uses its default genre.
+                genres[item["@id"]] = self.genre_map.get(codes[hathi_id], "none")
+        return genres
+
+    def _hathi_record_id(self, item):
+        """Return HathiTrust record number for an item.
+
+        Falls back to the end of the catalog url in "isShownAt" when the
+        original record was not requested (see projection_fields).
+        """
+        if "originalRecord" in item and "_id" in item["originalRecord"]:
+            return str(item["originalRecord"]["_id"])
+        return str(os.path.basename(item["isShownAt"].rstrip("/")))
+
     def _extract_genre(self, marc_string):
         """Extract appropriate byte-mark in 008 to indicate genre.
 
         args:
             marc_string(str): marc xml as string.
         """
-        path_008 = "/collection/record/controlfield[@tag='008']"
-        tree = etree.fromstring(marc_string.encode("utf-8"))
-        text_008 = tree.xpath(path_008)[0].text
-        if len(text_008) > 33:
-            genre = text_008[33]
-        else:
-            genre = "null"
-        return genre
+        return extract_genre(marc_string)
 
     def _get_hathi_record(self, item):
         """Get HathiTrust record.
@@ -260,8 +703,21 @@ class DplaApi():
             item (dict): Python dictionary from JSON results of DPLA search.
         """
         self.hathi_id = item["originalRecord"]["_id"]
-        hbi = HathiBibApi()
-        return hbi.get_record(self.hathi_id)
+        return self._get_hathi_api().get_record(self.hathi_id)
+
+    def _get_hathi_api(self):
+        """Return the HathiBibApi shared by all lookups, so connections are reused."""
+        if self.hathi_api is None:
+            self.hathi_api = HathiBibApi(pool_size=self.hathi_settings["workers"])
+        return self.hathi_api
+
+    def _get_genre_enricher(self):
+        """Return the GenreEnricher shared by all genre lookups."""
+        if self.genre_enricher is None:
+            self.genre_enricher = GenreEnricher(hathi_api=self._get_hathi_api(),
+                                                cache_path=self.hathi_settings["genre_cache"],
+                                                workers=self.hathi_settings["workers"])
+        return self.genre_enricher
 
     def _marc_record(self, item):
         """Check if item contains a MARC record.
@@ -299,106 +755,3 @@ class DplaApi():
                 f.write("<td><a href='"+url+"'>"+url+"</td>")
                 f.write("<tr>")
             f.write("</table>")
-
-    def return_marcxml(self):
-        if self.result is None:
-            print "Error -- No data available -- Run search first"
-            return
-
-        for item in self.items:
-            json_record = item["originalRecord"]
-            xml = self.build_marcxml_record(json_record)
-            if xml is not None:
-                with open(os.path.join(output_path, str(item["id"]))+".xml", "w") as f:
-                    f.write(etree.tostring(xml, encoding="utf-8", xml_declaration=True))
-                xml_processed += 1
-            else:
-                errors += 1
-
-        print "{0} Errors Returned".format(errors)
-        print "{0} XML Files Written".format(xml_processed)
-        print "{0} Non Standard Records".format(self.non_standard_records)
-        print "{0} MARC Namespace Records".format(self.marc_namespace)
-
-    def build_marcxml_record(self, json_record):
-
-        root = None
-        if "leader" not in json_record and "metadata" not in json_record:
-            self.non_standard_records += 1
-            #print "\n================Non Standard Record===============\n"
-            #print json_record
-            return None
-
-        elif "metadata" in json_record:
-
-            if "marc:record" in json_record["metadata"]:
-                self.marc_namespace += 1
-                json_record = json_record["metadata"]["marc:record"] 
-                try:
-                    root = etree.Element("record", xmlns="http://www.loc.gov/MARC21/slim")
-                    leader = etree.SubElement(root, "leader")
-                    leader.text = json_record["marc:leader"]
-                    for c in json_record["marc:controlfield"]:
-                        controlfield = etree.SubElement(root, "controlfield", tag=c["tag"])
-                        controlfield.text = c["#text"]
-                    for d in json_record["marc:datafield"]:
-                        datafield = etree.SubElement(root, "datafield", tag=d["tag"], ind1=d["ind1"], ind2=d["ind2"])
-                        # When there's only one subfield, d["subfield"] will return a dict. Otherwise, a list of dicts.
-                        if isinstance(d["marc:subfield"], dict):
-                            subfield = etree.SubElement(datafield, "subfield", code=d["marc:subfield"]["code"])
-                            subfield.text = d["marc:subfield"]["#text"]
-                        else:
-                            for s in d["marc:subfield"]:
-                                subfield = etree.SubElement(datafield, "subfield", code=s["code"])
-                                subfield.text = s["#text"]
-                except Exception as e:
-                    
-                    print "\n================Error In Record===============\n"
-                    print e
-                    print json_record
-                    return None
-
-        elif "leader" in json_record:
-
-            try:
-                root = etree.Element("record", xmlns="http://www.loc.gov/MARC21/slim")
-                leader = etree.SubElement(root, "leader")
-                leader.text = json_record["leader"]
-                for c in json_record["controlfield"]:
-                    controlfield = etree.SubElement(root, "controlfield", tag=c["tag"])
-                    controlfield.text = c["#text"]
-                for d in json_record["datafield"]:
-                    datafield = etree.SubElement(root, "datafield", tag=d["tag"], ind1=d["ind1"], ind2=d["ind2"])
-                    # When there's only one subfield, d["subfield"] will return a dict. Otherwise, a list of dicts.
-                    if isinstance(d["subfield"], dict):
-                        subfield = etree.SubElement(datafield, "subfield", code=d["subfield"]["code"])
-                        subfield.text = d["subfield"]["#text"]
-                    else:
-                        for s in d["subfield"]:
-                            subfield = etree.SubElement(datafield, "subfield", code=s["code"])
-                            subfield.text = s["#text"]
-            except Exception as e:
-                
-                print "\n================Error In Record===============\n"
-                print e
-                print json_record
-                return None
-
-        return root
-        """
-        # Changes from lib computer. For future review.
-        root = etree.Element("record", xmlns="http://www.loc.gov/MARC21/slim")
-        leader = etree.SubElement(root, "leader")
-        leader.text = json_record["leader"]
-        for c in json_record["controlfield"]:
-            controlfield = etree.SubElement(root, "controlfield", tag=c["tag"])
-            controlfield.text = c["#text"]
-
-            for row in q_datafields:
-                datafield = etree.SubElement(root,"datafield",tag=row.tag,ind1=row.ind1,ind2=row.ind2)
-                q_subfields = Subfields.objects.using("metagds").filter(datafield=row.datafield_id)
-                for sub_row in q_subfields:
-                    subfield = etree.SubElement(datafield,"subfield",code=sub_row.code)
-                    subfield.text = sub_row.content
-        """
-
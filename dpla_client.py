@@ -0,0 +1,200 @@
+"""HTTP client for the DPLA search API, with connection pooling, retries and backoff."""
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from response_cache import SearchResult
+import fastjson
+import random
+import requests
+import threading
+import time
+
+# Responses worth retrying: rate limited, or a temporary server-side failure.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def retry_after_seconds(value):
+    """Return seconds to wait from a Retry-After header (delay in seconds, or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, mktime_tz(parsed) - time.time())
+
+
+class AsyncDplaClient(object):
+    """Client for the DPLA v2 items endpoint.
+
+    Requests share a pooled, keep-alive session and ask for gzip-compressed
+    responses. Connection errors, timeouts, 429 and 5xx responses are
+    retried with jittered exponential backoff; a 429 or 503 with a
+    Retry-After header waits as long as the server asks. If a rate limiter
+    is given, every attempt, retries included, waits for one of its tokens.
+
+    search_page() blocks until the page arrives; search_async() requests it
+    on the client's thread pool and returns an AsyncResult straight away.
+    Both give pages with the count/limit/items attributes DplaApi uses.
+    """
+
+    search_url = "https://api.dp.la/v2/items"
+
+    def __init__(self, api_key, workers=4, timeout=60, connect_timeout=10, max_retries=5,
+                 backoff=1.0, backoff_max=60.0, metrics=None, rate_limiter=None):
+        """Open session.
+
+        args:
+            api_key(str): DPLA API key.
+        kwargs:
+            workers(int): connections kept open, and threads used by search_async.
+                More connections can be kept with ensure_connections.
+            timeout(float): seconds to wait for data from the server.
+            connect_timeout(float): seconds to wait for a connection.
+            max_retries(int): retries of a failed request before giving up.
+            backoff(float): base delay in seconds, doubled for every retry.
+            backoff_max(float): longest delay between retries.
+            metrics(PipelineMetrics): records throttle, request and decode time, bytes and retries.
+            rate_limiter(TokenBucket): limiter shared with other clients of the API quota.
+        """
+        self.api_key = api_key
+        self.workers = workers
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        self.connections = 0
+        self.pool = None
+        self.lock = threading.Lock()
+        self.ensure_connections(workers)
+
+    def search_page(self, q_value, page_size=100, page=1, fields=[], label=None):
+        """Request one page of search results.
+
+        args:
+            q_value (str or dict) -- value to search, or dict of searchFields
+                (full field names, e.g. "sourceResource.subject.name").
+        kwargs:
+            page_size (int) -- number of results per page.
+            page (int) -- page of results to request.
+            fields (list) -- fields to request for each item.
+            label (str) -- name of the query in metrics; defaults to q_value.
+        returns:
+            (SearchResult) count, limit and items of the page.
+        raises:
+            requests.RequestException once max_retries retries have failed.
+        """
+        params = {"api_key": self.api_key, "page_size": page_size, "page": page}
+        if isinstance(q_value, dict):
+            params.update(q_value)
+        else:
+            params["q"] = q_value
+        if fields:
+            params["fields"] = ",".join(fields)
+
+        if label is None:
+            label = q_value
+        start = time.time()
+        response = self.__get(params, label)
+        self.__record("request", label, seconds=time.time() - start, bytes=len(response.content))
+        start = time.time()
+        data = fastjson.loads(response.content)
+        self.__record("decode", label, seconds=time.time() - start, items=len(data["docs"]))
+        return SearchResult(data["count"], data["limit"], data["docs"])
+
+    def search_async(self, q_value, page_size=100, page=1, fields=[], label=None, callback=None):
+        """Request a page of search results in the background.
+
+        Takes the same arguments as search_page.
+
+        kwargs:
+            callback(function): called with the page once it arrives.
+        returns:
+            (AsyncResult) whose get() returns the page, or raises its error.
+        """
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+        return self.pool.apply_async(self.search_page, (q_value, page_size, page, fields, label),
+                                     callback=callback)
+
+    def ensure_connections(self, count):
+        """Keep at least count connections open, e.g. for a thread pool larger than workers.
+
+        Requests from more threads than there are pooled connections would
+        each open a connection that is closed again, rather than kept alive.
+        """
+        count = max(count, 1)
+        with self.lock:
+            if count > self.connections:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=count)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+                self.connections = count
+
+    def close(self):
+        """Stop the thread pool and close pooled connections."""
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+        self.session.close()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Return seconds to wait before a retry.
+
+        The delay is drawn at random between 0 and backoff * 2 ** attempt
+        (capped at backoff_max), so clients that failed together do not
+        retry together. A Retry-After delay from the server is used as the
+        minimum.
+
+        args:
+            attempt(int): number of retries already made.
+        kwargs:
+            retry_after(float): seconds the server asked the client to wait.
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay += retry_after
+        return delay
+
+    def __get(self, params, label):
+        """Make a GET request, retrying transient failures."""
+        attempt = 0
+        while True:
+            retry_after = None
+            self.__throttle(label)
+            try:
+                response = self.session.get(self.search_url, params=params, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError("{0} error for {1}".format(response.status_code, self.search_url),
+                                           response=response)
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+            if attempt >= self.max_retries:
+                raise error
+            self.__record("request", label, calls=0, retries=1)
+            time.sleep(self.backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def __throttle(self, label):
+        """Wait for a token from the rate limiter, if there is one."""
+        if self.rate_limiter is not None:
+            start = time.time()
+            self.rate_limiter.consume()
+            self.__record("throttle", label, seconds=time.time() - start)
+
+    def __record(self, stage, label, **counters):
+        """Add to the metrics of a stage, if metrics are kept."""
+        if self.metrics is not None:
+            self.metrics.add(stage, label, **counters)
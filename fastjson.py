@@ -0,0 +1,65 @@
+"""Decode JSON with the fastest available library.
+
+orjson or ujson is used when installed, falling back to the standard json
+module. Every decoder accepts the raw (utf-8) bytes of a response or file,
+so data need not be decoded to unicode before parsing.
+"""
+import json
+
+DECODERS = ["orjson", "ujson", "json"]
+
+_decoder = None
+decoder_name = None
+
+
+def _import_decoder(name):
+    """Return the loads function of a decoder library, or None if it is not installed."""
+    if name == "json":
+        return json.loads
+    try:
+        module = __import__(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def set_decoder(name="auto"):
+    """Choose the library used by loads().
+
+    kwargs:
+        name(str): 'orjson', 'ujson' or 'json', or 'auto' for the first
+            of those that is installed.
+    returns:
+        (str) name of the library in use.
+    """
+    global _decoder, decoder_name
+    if name == "auto":
+        candidates = DECODERS
+    elif name in DECODERS:
+        candidates = [name]
+    else:
+        raise ValueError("Invalid JSON decoder: {0}".format(name))
+    for candidate in candidates:
+        decoder = _import_decoder(candidate)
+        if decoder is not None:
+            _decoder = decoder
+            decoder_name = candidate
+            return decoder_name
+    raise ImportError("JSON decoder is not installed: {0}".format(name))
+
+
+def loads(data):
+    """Decode a JSON document.
+
+    args:
+        data(str or unicode): JSON text, or its utf-8 encoded bytes.
+    """
+    return _decoder(data)
+
+
+def load(json_file):
+    """Decode a JSON document from a file object; open it in "rb" mode to skip text decoding."""
+    return _decoder(json_file.read())
+
+
+set_decoder()
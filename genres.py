@@ -0,0 +1,147 @@
+"""Look up 'literary form' genre codes from HathiTrust MARC records."""
+from hathi import HathiBibApi
+from lxml import etree
+from multiprocessing.pool import ThreadPool
+import codecs
+import os
+import re
+import requests
+import threading
+
+# Matches the text of a (possibly namespace-prefixed) 008 control field.
+CONTROLFIELD_008 = re.compile(r"""<(?:\w+:)?controlfield\s+tag=["']008["']\s*>([^<]*)</""")
+
+
+def extract_genre(marc_string):
+    """Extract appropriate byte-mark in 008 to indicate genre.
+
+    The 008 field is found with a precompiled pattern rather than by parsing
+    the whole record. Records the pattern does not match, or whose 008 text
+    contains entity references, are parsed in full.
+
+    args:
+        marc_string(str): marc xml as string.
+    """
+    match = CONTROLFIELD_008.search(marc_string)
+    if match is None or "&" in match.group(1):
+        return _parse_genre(marc_string)
+    return _genre_from_008(match.group(1))
+
+
+def extract_genres(records):
+    """Extract genre codes from a multi-record HathiTrust response.
+
+    args:
+        records(dict): results of HathiBibApi.get_records, keyed by record number.
+    returns:
+        (dict) genre code for each record number. Records without a usable
+        008 field map to "null".
+    """
+    codes = {}
+    for hathi_id, result in records.items():
+        try:
+            codes[hathi_id] = extract_genre(result["records"][hathi_id]["marc-xml"])
+        except (KeyError, IndexError, TypeError, etree.XMLSyntaxError):
+            codes[hathi_id] = "null"
+    return codes
+
+
+def _genre_from_008(text_008):
+    """Return byte 33 of the 008 field, or "null" if the field is too short."""
+    if len(text_008) > 33:
+        return text_008[33]
+    return "null"
+
+
+def _parse_genre(marc_string):
+    """Extract genre from the 008 field by parsing the full record.
+
+    args:
+        marc_string(str): marc xml as string.
+    """
+    path_008 = "/collection/record/controlfield[@tag='008']"
+    tree = etree.fromstring(marc_string.encode("utf-8"))
+    text_008 = tree.xpath(path_008)[0].text
+    return _genre_from_008(text_008)
+
+
+class GenreEnricher(object):
+    """Resolve 008 genre codes for HathiTrust records, concurrently and with an on-disk cache.
+
+    The cache is a tab-separated file of HathiTrust record ids and their
+    genre codes. Codes, rather than mapped genre names, are stored so the
+    mapping can change without invalidating the cache.
+    """
+
+    def __init__(self, hathi_api=None, cache_path="data/hathi_genres.tsv", workers=4):
+        """Load cached genre codes.
+
+        kwargs:
+            hathi_api(HathiBibApi): api used for lookups; a new one is created by default.
+            cache_path(str): path of the genre code cache.
+            workers(int): number of multi-id requests made concurrently.
+        """
+        self.hathi_api = hathi_api or HathiBibApi(pool_size=workers)
+        self.cache_path = cache_path
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.codes = {}
+        if os.path.exists(cache_path):
+            with codecs.open(cache_path, "r", "utf-8") as cache_file:
+                for line in cache_file:
+                    hathi_id, _, code = line.rstrip("\n").partition("\t")
+                    self.codes[hathi_id] = code
+
+    def lookup(self, hathi_ids):
+        """Return genre codes for HathiTrust record ids.
+
+        Ids not in the cache are requested in multi-id batches spread over a
+        thread pool, and the results are appended to the cache. Ids in a
+        batch whose request fails are left out of the result and the cache,
+        so they are requested again by the next lookup.
+
+        args:
+            hathi_ids(iterable): HathiTrust record numbers.
+        returns:
+            (dict) genre code for each id. Ids HathiTrust has no record for
+            map to "", and records without a usable 008 field to "null".
+        """
+        hathi_ids = set(hathi_ids)
+        missing = [hathi_id for hathi_id in hathi_ids if hathi_id not in self.codes]
+        if missing:
+            batch_size = self.hathi_api.max_batch_size
+            batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+            failed = 0
+            pool = ThreadPool(min(self.workers, len(batches)))
+            try:
+                for batch_ids, codes in pool.imap_unordered(self.__fetch_batch, batches):
+                    if codes is None:
+                        failed += len(batch_ids)
+                    else:
+                        self.__store(codes)
+            finally:
+                pool.terminate()
+                pool.join()
+            if failed:
+                print "----Genres: HathiTrust lookup failed for {0} records".format(failed)
+        return dict((hathi_id, self.codes[hathi_id]) for hathi_id in hathi_ids if hathi_id in self.codes)
+
+    def __fetch_batch(self, hathi_ids):
+        """Request one batch of records and extract their genre codes.
+
+        returns:
+            (tuple) the batch's ids, and their codes, or None if the request failed.
+        """
+        codes = dict((hathi_id, "") for hathi_id in hathi_ids)
+        try:
+            codes.update(extract_genres(self.hathi_api.get_records(hathi_ids)))
+        except (requests.RequestException, ValueError):
+            return hathi_ids, None
+        return hathi_ids, codes
+
+    def __store(self, codes):
+        """Add codes to the in-memory and on-disk caches."""
+        with self.lock:
+            self.codes.update(codes)
+            with codecs.open(self.cache_path, "a", "utf-8") as cache_file:
+                cache_file.write("".join(u"{0}\t{1}\n".format(hathi_id, code) for hathi_id, code in codes.items()))
@@ -0,0 +1,278 @@
+"""Harvest many DPLA queries on a shared, rate-limited worker pool."""
+from __future__ import division
+from collections import deque
+from dpla_api import DplaApi
+from item_store import merge_query
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+import argparse
+import fastjson
+import hashlib
+import json
+import math
+import os
+
+
+class BatchHarvester(object):
+    """Run a list of DPLA searches, checkpointing each finished query to disk."""
+
+    def __init__(self, checkpoint_dir="data/checkpoints", workers=None, dpla_api=None):
+        """Prepare checkpoint directory and load the list of completed queries.
+
+        kwargs:
+            checkpoint_dir(str): directory holding per-query results and the
+                manifest of completed queries.
+            workers(int): size of the thread pool shared by every query.
+                Defaults to the [search] setting in default.cfg.
+            dpla_api(DplaApi): api instance to use; a new one is created by default.
+        """
+        self.dpla_api = dpla_api or DplaApi()
+        self.workers = max(workers or self.dpla_api.search_workers, 1)
+        self.dpla_api.client.ensure_connections(self.workers)
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest_path = os.path.join(checkpoint_dir, "completed.txt")
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        self.__load_manifest()
+
+    def harvest(self, queries, page_size=500, check_match=True, id_match=None, project=None,
+                enrich_genres=None):
+        """Search every query that has not already been checkpointed.
+
+        Page requests for all queries go through one thread pool, and the
+        first pages of upcoming queries are requested while the current
+        query's remaining pages are still being fetched.
+
+        args:
+            queries(list or dict): list of values to search, or a dict mapping
+                each value to its "|"-separated disciplines
+                (see data/dpla_subjects.json).
+        kwargs:
+            page_size(int): results per page (DPLA-imposed limit is 500).
+            check_match(bool): passed through to DplaApi.iter_arc_records.
+            id_match(str): passed through to DplaApi.iter_arc_records.
+            project(bool): request only the fields used to build ARC records.
+                Defaults to the [search] setting in default.cfg.
+            enrich_genres(bool): passed through to DplaApi.iter_arc_records.
+        """
+        if isinstance(queries, dict):
+            disciplines = queries
+            queries = sorted(queries.keys())
+        else:
+            disciplines = {}
+
+        pending = [q for q in queries if self._query_key(q) not in self.completed]
+        for checkpoint in self.__checkpoints():
+            for record in checkpoint["records"]:
+                self.dpla_api.item_store.add_id(record["id"])
+        print "Harvesting {0} queries ({1} already completed)".format(
+            len(pending), len(queries) - len(pending))
+
+        fields = self.dpla_api._resolve_fields([], project)
+        window = self.workers * 2
+        first_pages = [None] * len(pending)
+        failures = 0
+        pool = ThreadPool(self.workers)
+        try:
+            with self.dpla_api.metrics.profile("harvest"):
+                for i, q_value in enumerate(pending):
+                    for j in range(i, min(i + window, len(pending))):
+                        if first_pages[j] is None:
+                            first_pages[j] = pool.apply_async(
+                                self.dpla_api._search_page, (pending[j], page_size, 1, fields))
+                    try:
+                        self._harvest_query(pool, q_value, first_pages[i].get(), page_size, fields,
+                                            disciplines.get(q_value, ""), check_match, id_match, enrich_genres)
+                    except Exception as e:
+                        print "----Failed: '{0}' ({1})".format(q_value, e)
+                        failures += 1
+                    first_pages[i] = False
+        finally:
+            pool.terminate()
+            pool.join()
+
+        print "Completed {0} queries, {1} failed".format(len(pending) - failures, failures)
+        self.dpla_api.export_metrics()
+        print self.dpla_api.metrics.summary()
+
+    def _harvest_query(self, pool, q_value, first_page, page_size, fields, disciplines, check_match, id_match,
+                       enrich_genres):
+        """Compile the records of one query as its pages arrive and checkpoint them."""
+        api = self.dpla_api
+        api.query = api._query_label(q_value)
+        print "Query: '{0}' returned {1} results".format(api.query, first_page.count)
+
+        # Items found by earlier queries are only recorded by id in this query's checkpoint.
+        merged = []
+        items = self._iter_items(pool, q_value, first_page, page_size, fields, merged)
+        # New ids are only registered once the checkpoint is on disk, so a
+        # query that fails is searched and compiled again by the next run.
+        new_ids = []
+        store_size = len(api.item_store)
+        try:
+            records = list(api.iter_arc_records(items, check_match=check_match, disciplines=disciplines,
+                                                id_match=id_match, enrich_genres=enrich_genres,
+                                                item_store=api.item_store, new_ids=new_ids))
+            record_ids = set(record["id"] for record in records)
+            merged = [item_id for item_id in merged if item_id not in record_ids]
+            self._checkpoint(q_value, records, merged, disciplines)
+        except Exception:
+            api.item_store.truncate(store_size)
+            raise
+        if new_ids:
+            for item_id in new_ids:
+                api.registry.add(item_id)
+            api._store_match_data()
+        # Records are read back from the checkpoints by records(); only their ids are kept.
+        for record in records:
+            api.item_store.drop_record(record["id"])
+
+    def _iter_items(self, pool, q_value, first_page, page_size, fields, merged):
+        """Yield the items of one query in page order.
+
+        Later pages are requested on the shared pool at most `workers` pages
+        ahead of the page being read, so only those pages are held in memory.
+
+        args:
+            merged(list): ids of items already in the item store are appended to it.
+        """
+        item_store = self.dpla_api.item_store
+        merged_ids = set()
+        for result in self.__iter_pages(pool, q_value, first_page, page_size, fields):
+            for item in result.items:
+                if item["@id"] in item_store and item["@id"] not in merged_ids:
+                    merged_ids.add(item["@id"])
+                    merged.append(item["@id"])
+                yield item
+
+    def __iter_pages(self, pool, q_value, first_page, page_size, fields):
+        """Yield the first page, then the query's other pages as they are fetched in order."""
+        yield first_page
+        if first_page.count <= first_page.limit:
+            return
+        pages = iter(range(2, int(math.ceil(first_page.count / first_page.limit)) + 1))
+        in_flight = deque(pool.apply_async(self.dpla_api._search_page, (q_value, page_size, page, fields))
+                          for page in islice(pages, self.workers))
+        while in_flight:
+            result = in_flight.popleft()
+            for page in islice(pages, 1):
+                in_flight.append(pool.apply_async(self.dpla_api._search_page, (q_value, page_size, page, fields)))
+            yield result.get()
+
+    def records(self):
+        """Yield one merged metadata record per item from every checkpointed query.
+
+        Records are streamed from the checkpoints, in the order their items
+        were first found. A first pass reads which later queries returned
+        each item again, so every record is output once, with all of its
+        queries in "original_query" and their disciplines merged. Only item
+        ids and queries are held in memory.
+        """
+        returned_again = {}
+        unwritten = set()
+        for checkpoint in self.__checkpoints():
+            repeats = [record["id"] for record in checkpoint["records"] if record["id"] in unwritten]
+            unwritten.update(record["id"] for record in checkpoint["records"])
+            for item_id in repeats + checkpoint["merged"]:
+                returned_again.setdefault(item_id, []).append((checkpoint["query"], checkpoint["disciplines"]))
+
+        for checkpoint in self.__checkpoints():
+            for record in checkpoint["records"]:
+                if record["id"] not in unwritten:
+                    continue
+                unwritten.remove(record["id"])
+                merge_query(record, None)
+                for query, disciplines in returned_again.pop(record["id"], []):
+                    merge_query(record, query, disciplines)
+                yield record
+
+    def write_tsv(self, output_path="data/radicalism-dpla.tsv"):
+        """Write all checkpointed records to a single TSV file."""
+        self.dpla_api.create_tsv(records=self.records(), output_path=output_path)
+
+    def write_rdf(self, output_path="rdf/dpla.xml", records_per_file=500):
+        """Build RDF files from all checkpointed records, without a TSV file."""
+        self.dpla_api.create_rdf(records=self.records(), output_path=output_path,
+                                 records_per_file=records_per_file)
+
+    def _checkpoint(self, q_value, records, merged=[], disciplines=""):
+        """Store the records for a finished query and mark it as completed.
+
+        The records file is written first and renamed into place, so a query
+        is only listed in the manifest once its results are safely on disk.
+
+        args:
+            q_value(str or dict): query searched.
+            records(list): records of items first found by this query.
+        kwargs:
+            merged(list): ids of items returned by this query that earlier
+                queries had already found.
+            disciplines(str): "|"-separated disciplines of the query.
+        """
+        key = self._query_key(q_value)
+        path = self.__checkpoint_path(key)
+        query = self.dpla_api._query_label(q_value)
+        with self.dpla_api.metrics.stage("checkpoint", query, items=len(records)) as timer:
+            with open(path + ".tmp", "w") as checkpoint_file:
+                json.dump({"query": query, "disciplines": disciplines, "merged": merged,
+                           "records": [record.to_dict() for record in records]}, checkpoint_file)
+            os.rename(path + ".tmp", path)
+            timer.bytes = os.path.getsize(path)
+
+        with open(self.manifest_path, "a") as manifest:
+            manifest.write("{0}\t{1}\n".format(key, json.dumps(q_value)))
+            manifest.flush()
+            os.fsync(manifest.fileno())
+        self.completed.add(key)
+        self.completed_order.append(key)
+
+    def _query_key(self, q_value):
+        """Return a stable, filename-safe key for a query."""
+        return hashlib.md5(json.dumps(q_value, sort_keys=True)).hexdigest()
+
+    def __checkpoint_path(self, key):
+        """Return path of the records file for a query key."""
+        return os.path.join(self.checkpoint_dir, key + ".json")
+
+    def __checkpoints(self):
+        """Yield the contents of each completed query's checkpoint, in completion order."""
+        for key in self.completed_order:
+            with open(self.__checkpoint_path(key), "rb") as checkpoint_file:
+                checkpoint = fastjson.load(checkpoint_file)
+            if isinstance(checkpoint, list):
+                # Checkpoints written before items were merged across queries.
+                query = checkpoint[0]["original_query"] if checkpoint else None
+                checkpoint = {"query": query, "disciplines": "", "merged": [], "records": checkpoint}
+            yield checkpoint
+
+    def __load_manifest(self):
+        """Load keys of queries completed by previous runs."""
+        self.completed = set()
+        self.completed_order = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest:
+                for line in manifest:
+                    key = line.split("\t", 1)[0]
+                    if key and key not in self.completed:
+                        self.completed.add(key)
+                        self.completed_order.append(key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest a list of DPLA queries into a TSV file.")
+    parser.add_argument("subjects_path", help="JSON list of queries, or dict of query to disciplines.")
+    parser.add_argument("--output", default="data/radicalism-dpla.tsv")
+    parser.add_argument("--rdf", action="store_true", help="Write RDF files to --output instead of a TSV file.")
+    parser.add_argument("--checkpoint-dir", default="data/checkpoints")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.subjects_path, "r") as subjects_file:
+        subjects = json.load(subjects_file)
+    harvester = BatchHarvester(checkpoint_dir=args.checkpoint_dir, workers=args.workers)
+    harvester.harvest(subjects, page_size=args.page_size)
+    if args.rdf:
+        harvester.write_rdf(output_path=args.output)
+    else:
+        harvester.write_tsv(output_path=args.output)
@@ -1,14 +1,30 @@
 """Access HathiTrust bibliographic API: https://www.hathitrust.org/bib_api."""
+import fastjson
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class HathiBibApi(object):
     """Access metadata via the HathiTrust bibliographic API."""
 
-    def __init__(self):
-        """Init urls."""
+    # The bib API accepts at most 20 ids per multi-id request.
+    max_batch_size = 20
+
+    def __init__(self, pool_size=10, timeout=30):
+        """Init urls and a pooled session reused by every request.
+
+        kwargs:
+            pool_size(int): max connections kept open to the API.
+            timeout(int): seconds to wait for a response.
+        """
         self.base_url_brief = "http://catalog.hathitrust.org/api/volumes/brief/<idtype>/<idvalue>.json"
         self.base_url_full = "http://catalog.hathitrust.org/api/volumes/full/<idtype>/<idvalue>.json"
+        self.base_url_multi = "http://catalog.hathitrust.org/api/volumes/<resulttype>/json/<requests>"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def get_record(self, id_value, result_type="full", id_type="recordnumber"):
         """Return record via call to API.
@@ -31,7 +47,40 @@ class HathiBibApi(object):
 
         return self._make_request()
 
-    def _make_request(self):
-        """Make request with self.request_url."""
+    def get_records(self, id_values, result_type="full", id_type="recordnumber", batch_size=None):
+        """Return records for many ids, grouping them into multi-id requests.
+
+        args:
+            id_values(list): the id values to look up.
+        kwargs:
+            result_type(str): either 'full' or 'brief' (see get_record).
+            id_type(str): HT allows a variety of id types to be used.
+            batch_size(int): ids per request, capped at max_batch_size.
+        returns:
+            (dict) each id value mapped to its result, which has the same
+            shape as the result of get_record. Ids HT does not return are omitted.
+        """
+        if result_type not in ("full", "brief"):
+            raise ValueError("Invalid result_type: {0}".format(result_type))
+        batch_size = min(batch_size or self.max_batch_size, self.max_batch_size)
+        id_values = list(id_values)
+        results = {}
+        for start in range(0, len(id_values), batch_size):
+            batch = id_values[start:start + batch_size]
+            request_keys = dict(("{0}:{1}".format(id_type, id_value), id_value) for id_value in batch)
+            request_url = self.base_url_multi.replace("<resulttype>", result_type)\
+                                             .replace("<requests>", "|".join(request_keys))
+            for request_key, result in self._make_request(request_url).items():
+                if request_key in request_keys:
+                    results[request_keys[request_key]] = result
+        return results
+
+    def _make_request(self, request_url=None):
+        """Make request with request_url, or self.request_url if not given.
+
+        get_records passes its url explicitly, so it can be called from several threads.
+        """
         # print self.request_url
-        return requests.get(self.request_url).json()
+        response = self.session.get(request_url or self.request_url, timeout=self.timeout)
+        response.raise_for_status()
+        return fastjson.loads(response.content)
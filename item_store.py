@@ -0,0 +1,103 @@
+"""Store of metadata records shared across queries, keyed on DPLA item id."""
+from collections import OrderedDict
+from metadpla import share
+
+
+def merge_disciplines(disciplines, more_disciplines):
+    """Return the union of two "|"-separated discipline strings, in order of appearance."""
+    values = []
+    for value in disciplines.split("|") + more_disciplines.split("|"):
+        value = value.strip()
+        if value and value not in values:
+            values.append(value)
+    return "|".join(values)
+
+
+def merge_query(record, query, disciplines=""):
+    """Add a query that returned an item to the item's record.
+
+    The record's "original_query" becomes a list if it is not one already.
+
+    args:
+        record(dict): metadata record of the item.
+        query(str or dict): query that returned the item; None only converts
+            "original_query" to a list.
+    kwargs:
+        disciplines(str): "|"-separated disciplines of the query.
+    """
+    queries = record.get("original_query")
+    if not isinstance(queries, list):
+        queries = record["original_query"] = [] if queries is None else [queries]
+    if query is not None and query not in queries:
+        queries.append(query)
+    if disciplines:
+        record["discipline"] = share(merge_disciplines(record.get("discipline", ""), disciplines))
+
+
+class ItemStore(object):
+    """One metadata record per DPLA item, whichever queries returned it.
+
+    The first query to return an item has its record compiled and stored.
+    Later queries returning the same item only add themselves to the
+    record's "original_query" list (and their disciplines to its
+    "discipline"), so the item is compiled and output once.
+
+    An id can also be stored without its record, e.g. for items whose
+    records were written by an earlier, interrupted run; later queries
+    returning it are then still recognized as repeats.
+    """
+
+    def __init__(self):
+        self.items = OrderedDict()
+
+    def __contains__(self, item_id):
+        return item_id in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, record):
+        """Store the record of an item not seen before.
+
+        Its "original_query" becomes a list, so further queries can be added.
+
+        args:
+            record(MetadataRecord): record compiled for the item, with its "id".
+        """
+        merge_query(record, None)
+        self.items[record["id"]] = record
+
+    def add_id(self, item_id):
+        """Mark an item as seen, without storing its record."""
+        self.items.setdefault(item_id, None)
+
+    def truncate(self, size):
+        """Remove the items added after the store held size items, e.g. by a query that failed."""
+        while len(self.items) > size:
+            self.items.popitem()
+
+    def drop_record(self, item_id):
+        """Release the record of an item, keeping its id."""
+        self.items[item_id] = None
+
+    def merge(self, item_id, query, disciplines=""):
+        """Add a query that returned an item already in the store.
+
+        args:
+            item_id(str): "@id" of the item.
+            query(str or dict): query that returned the item again.
+        kwargs:
+            disciplines(str): "|"-separated disciplines of the query.
+        returns:
+            (MetadataRecord) merged record, or None if only the id is stored.
+        """
+        record = self.items[item_id]
+        if record is not None:
+            merge_query(record, query, disciplines)
+        return record
+
+    def records(self):
+        """Yield stored records, in the order their items were first seen."""
+        for record in self.items.itervalues():
+            if record is not None:
+                yield record
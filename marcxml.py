@@ -0,0 +1,223 @@
+"""Export the MARC records carried in DPLA "originalRecord" payloads as MARCXML."""
+from collections import deque
+from itertools import islice
+from lxml import etree
+from multiprocessing import Pool
+import os
+
+MARC_NS = "http://www.loc.gov/MARC21/slim"
+
+# Key prefix used by each layout of originalRecord: records under
+# metadata/marc:record have "marc:"-prefixed keys, others have plain keys.
+LAYOUTS = {"marc": "marc:", "plain": ""}
+
+
+def record_layout(original_record):
+    """Find the layout and the MARC fields of an originalRecord.
+
+    args:
+        original_record(dict): "originalRecord" of a DPLA item.
+    returns:
+        (tuple) layout name ("marc", "plain" or "non_standard") and the
+        dict holding the MARC fields, or None for non-standard records.
+    """
+    metadata = original_record.get("metadata")
+    if isinstance(metadata, dict) and "marc:record" in metadata:
+        return "marc", metadata["marc:record"]
+    if "leader" in original_record:
+        return "plain", original_record
+    return "non_standard", None
+
+
+def _as_list(value):
+    """Return a repeatable field as a list; fields occurring once are single dicts."""
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def build_marcxml_record(original_record):
+    """Build a MARCXML record element from an originalRecord.
+
+    Elements are built without a namespace; the <collection> element they
+    are written into declares the MARC namespace as the default.
+
+    args:
+        original_record(dict): "originalRecord" of a DPLA item.
+    returns:
+        (tuple) layout name and record element (None for non-standard records).
+    raises:
+        KeyError, TypeError or ValueError if the fields are malformed.
+    """
+    layout, fields = record_layout(original_record)
+    if fields is None:
+        return layout, None
+    prefix = LAYOUTS[layout]
+    root = etree.Element("record")
+    etree.SubElement(root, "leader").text = fields[prefix + "leader"]
+    for c in _as_list(fields.get(prefix + "controlfield", [])):
+        etree.SubElement(root, "controlfield", tag=c["tag"]).text = c.get("#text")
+    for d in _as_list(fields.get(prefix + "datafield", [])):
+        datafield = etree.SubElement(root, "datafield", tag=d["tag"], ind1=d["ind1"], ind2=d["ind2"])
+        for s in _as_list(d[prefix + "subfield"]):
+            etree.SubElement(datafield, "subfield", code=s["code"]).text = s.get("#text")
+    return layout, root
+
+
+def new_counts():
+    """Return empty per-layout counts of converted records and errors."""
+    return dict((layout, {"records": 0, "errors": 0}) for layout in list(LAYOUTS) + ["non_standard"])
+
+
+def add_counts(counts, more_counts):
+    """Add more_counts to counts, both as returned by new_counts."""
+    for layout, layout_counts in more_counts.items():
+        for key, value in layout_counts.items():
+            counts[layout][key] += value
+
+
+def convert_records(original_records):
+    """Serialize a chunk of originalRecords as MARCXML.
+
+    Module-level so it can be sent to a process pool.
+
+    args:
+        original_records(list): "originalRecord" of each item.
+    returns:
+        (tuple) list of serialized records (utf-8 bytes), and per-layout counts.
+    """
+    serialized = []
+    counts = new_counts()
+    for original_record in original_records:
+        try:
+            layout, record = build_marcxml_record(original_record)
+        except (KeyError, TypeError, ValueError):
+            counts[record_layout(original_record)[0]]["errors"] += 1
+            continue
+        if record is None:
+            counts[layout]["errors"] += 1
+            continue
+        serialized.append(etree.tostring(record, encoding="utf-8"))
+        counts[layout]["records"] += 1
+    return serialized, counts
+
+
+class MarcXmlWriter(object):
+    """Write serialized records into a MARCXML <collection> file as they arrive."""
+
+    def __init__(self, output_path):
+        """Open output file and write the collection start tag.
+
+        args:
+            output_path(str): path of the file to write.
+        """
+        self.output_path = output_path
+        self.output_file = open(output_path, "wb")
+        self.output_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                               '<collection xmlns="{0}">\n'.format(MARC_NS))
+        self.records_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record_xml):
+        """Add one record, serialized by convert_records."""
+        self.output_file.write(record_xml)
+        self.output_file.write("\n")
+        self.records_written += 1
+
+    def close(self):
+        """Write the collection end tag and close the file."""
+        self.output_file.write("</collection>\n")
+        self.output_file.close()
+
+
+class MarcXmlExporter(object):
+    """Stream DPLA items into MARCXML collection files of records_per_file records each."""
+
+    def __init__(self, output_path="data/marcxml/dpla.xml", records_per_file=10000, processes=None,
+                 chunk_size=1000):
+        """Set output options.
+
+        kwargs:
+            output_path(str): path of the first file; later files are numbered
+                (dpla_1.xml, dpla_2.xml...).
+            records_per_file(int): number of records in each file.
+            processes(int): convert chunks of items across a process pool of
+                this size; by default they are converted in this process.
+            chunk_size(int): number of items converted together.
+        """
+        self.output_path = output_path
+        self.records_per_file = records_per_file
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+    def export(self, items):
+        """Convert the MARC records of items and write them to collection files.
+
+        Items without an originalRecord are counted as non-standard.
+
+        args:
+            items(iterable): DPLA items, e.g. from DplaApi.iter_search.
+        returns:
+            (dict) converted records and errors for each layout.
+        """
+        self.files = []
+        self.counts = new_counts()
+        self.writer = None
+        output_dir = os.path.dirname(self.output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        items = iter(items)
+        chunks = iter(lambda: [item.get("originalRecord", {}) for item in islice(items, self.chunk_size)], [])
+        try:
+            for serialized, counts in self.__convert(chunks):
+                add_counts(self.counts, counts)
+                for record_xml in serialized:
+                    self.__write(record_xml)
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+        return self.counts
+
+    def __convert(self, chunks):
+        """Yield converted chunks in order, keeping at most 2 * processes chunks in flight."""
+        if not self.processes or self.processes < 2:
+            for chunk in chunks:
+                yield convert_records(chunk)
+            return
+        pool = Pool(self.processes)
+        in_flight = deque()
+        try:
+            for chunk in islice(chunks, self.processes * 2):
+                in_flight.append(pool.apply_async(convert_records, (chunk,)))
+            while in_flight:
+                result = in_flight.popleft()
+                for chunk in islice(chunks, 1):
+                    in_flight.append(pool.apply_async(convert_records, (chunk,)))
+                yield result.get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __write(self, record_xml):
+        """Write a record, starting a new file when the current one is full."""
+        if self.writer is not None and self.writer.records_written >= self.records_per_file:
+            self.writer.close()
+            self.writer = None
+        if self.writer is None:
+            self.writer = MarcXmlWriter(self.__file_path(len(self.files)))
+            self.files.append(self.writer.output_path)
+        self.writer.write(record_xml)
+
+    def __file_path(self, file_count):
+        """Return path of the output file with the given index."""
+        if file_count > 0:
+            output_parts = os.path.splitext(self.output_path)
+            return output_parts[0] + "_{0}".format(file_count) + output_parts[1]
+        return self.output_path
@@ -1,9 +1,105 @@
 """Assess and extract from DPLA metadata."""
 
+# Repeated values (sources, languages, types...) shared across records; see share().
+_shared_values = {}
+
+
+def share(value):
+    """Return a single shared copy of a repeated string value.
+
+    Strings decoded from each DPLA page are new objects, so values such as
+    "English" would otherwise be stored once per record.
+    """
+    if isinstance(value, basestring):
+        return _shared_values.setdefault(value, value)
+    return value
+
+
+class MetadataRecord(object):
+    """Compact ARC metadata record.
+
+    Fields are stored in __slots__ rather than a per-record dict. The dict
+    operations used on records (indexing, get, keys, items, "in") are supported,
+    and to_dict() gives a plain dict, e.g. for JSON.
+    """
+
+    __slots__ = ("date", "title", "subjects", "type", "creator", "language", "description",
+                 "thumbnail", "seeAlso", "source", "discipline", "genre", "archive", "role",
+                 "federation", "original_query", "id")
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return "MetadataRecord({0!r})".format(self.to_dict())
+
+    def get(self, key, default=None):
+        """Return value of field, or default if it is not set."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return names of the fields that are set, in slot order."""
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        """Return (field, value) pairs for the fields that are set."""
+        return [(key, getattr(self, key)) for key in self.__slots__ if hasattr(self, key)]
+
+    def to_dict(self):
+        """Return record as a plain dict."""
+        return dict(self.items())
+
+
+def _date_value(date):
+    """Return the display date of a "sourceResource" date value."""
+    if isinstance(date, list):
+        for key in ("displayDate", "begin", "end"):
+            if key in date[0]:
+                return date[0][key]
+        return ""
+    elif isinstance(date["displayDate"], list):
+        return date["displayDate"][0]
+    return date["displayDate"]
+
+
+def _first_value(value):
+    """Return the first of a list of values, or a single value as is."""
+    if isinstance(value, list):
+        return value[0]
+    return value
+
 
 class DplaMetadata():
     """DPLA metadata class."""
 
+    # "sourceResource" fields read by compile().
+    source_fields = ["date", "title", "description", "subject", "specType", "creator", "language", "type"]
+
     def __init__(self, dpla_metadata):
         """Initialize object containing just the DPLA-level metadata (not from original record).
 
@@ -14,16 +110,15 @@ class DplaMetadata():
 
     def compile(self):
         """Pull relevant metadata for ARC record, and record fields not found."""
-        record = {
-
-                        "date": "",
-                        "title": "",
-                        "subjects": [],
-                        "type": [],
-                        "creator": [],
-                        "language": [],
-                        "description": "",
-                    }
+        record = MetadataRecord(
+                        date="",
+                        title="",
+                        subjects=[],
+                        type=[],
+                        creator=[],
+                        language=[],
+                        description="",
+                    )
 
         if "date" in self.metadata:
             if isinstance(self.metadata["date"], list):
@@ -60,16 +155,63 @@ class DplaMetadata():
             record["subjects"] = [subject["name"] for subject in self.metadata["subject"] if "name" in subject]
 
         if "specType" in self.metadata:
-            record["type"] = self.metadata["specType"]
+            record["type"] = self.__share_all(self.metadata["specType"])
 
         if "creator" in self.metadata:
             record["creator"] = self.metadata["creator"]
 
         if "language" in self.metadata:
 
-            record["language"] = [lang["name"] for lang in self.metadata["language"]]
+            record["language"] = [share(lang["name"]) for lang in self.metadata["language"]]
 
         if "type" in self.metadata:
-            record["type"] = self.metadata["type"]
+            record["type"] = self.__share_all(self.metadata["type"])
 
         self.record = record
+
+    @classmethod
+    def compile_batch(cls, sources):
+        """Compile a page of "sourceResource" objects column by column.
+
+        Gives the same values as compile() on each object in turn, but each
+        field is normalized for the whole page in a single pass.
+
+        args:
+            sources(list): "sourceResource"-level metadata of each item.
+        returns:
+            (dict) list of values for each record field, in the order of sources.
+        """
+        sources = list(sources)
+        return {
+            "date": [_date_value(source["date"]) if "date" in source else "" for source in sources],
+            "title": [_first_value(source["title"]) if "title" in source else "" for source in sources],
+            "description": [_first_value(source["description"]) if "description" in source else ""
+                            for source in sources],
+            "subjects": [[subject["name"] for subject in source["subject"] if "name" in subject]
+                         if "subject" in source else [] for source in sources],
+            "type": [cls.__share_all(source["type"]) if "type" in source
+                     else cls.__share_all(source["specType"]) if "specType" in source else []
+                     for source in sources],
+            "creator": [source.get("creator", []) for source in sources],
+            "language": [[share(lang["name"]) for lang in source["language"]] if "language" in source else []
+                         for source in sources],
+        }
+
+    @staticmethod
+    def batch_records(columns):
+        """Return a MetadataRecord for each row of compile_batch() output."""
+        names = list(columns)
+        records = []
+        for row in zip(*[columns[name] for name in names]):
+            record = MetadataRecord()
+            for name, value in zip(names, row):
+                setattr(record, name, value)
+            records.append(record)
+        return records
+
+    @staticmethod
+    def __share_all(value):
+        """Share a string value, or each string in a list of values."""
+        if isinstance(value, list):
+            return [share(v) for v in value]
+        return share(value)
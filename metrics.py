@@ -0,0 +1,240 @@
+"""Record timings and counts for each stage of the harvest pipeline."""
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import resource
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Counters kept for every stage and query.
+COUNTERS = ["seconds", "calls", "items", "bytes", "retries"]
+
+
+def peak_memory_bytes():
+    """Return the peak resident memory of this process."""
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _prometheus_label(value):
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class StageTimer(object):
+    """Counts for one timed run of a stage; items and bytes can be added while it runs."""
+
+    def __init__(self):
+        self.items = 0
+        self.bytes = 0
+        self.retries = 0
+
+
+class PipelineMetrics(object):
+    """Thread-safe totals of time, items, bytes and retries per stage and per query.
+
+    Stages are named after the work they time, e.g. "request", "decode",
+    "compile", "registry", "genres", "tsv" or "rdf". Counters are kept per
+    query, and can be exported as a line of a JSON log or as a Prometheus
+    textfile (where they are summed over queries).
+
+    Each stage and query also keeps a memory high-water mark: the peak
+    resident memory of the process (ru_maxrss) when a timed run of the
+    stage ended. As that peak never goes down, it shows the first stage
+    whose runs raised it, rather than memory used by the stage alone.
+    """
+
+    def __init__(self, profile_dir=None):
+        """Start with empty counters.
+
+        kwargs:
+            profile_dir(str): directory in which profile() writes cProfile stats
+                (and tracemalloc statistics where available); profiling is
+                disabled if not given.
+        """
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.started = time.time()
+        self.profiling = False
+
+    def add(self, stage, query=None, seconds=0.0, calls=1, items=0, bytes=0, retries=0, peak_memory=0):
+        """Add to the counters of a stage.
+
+        args:
+            stage(str): name of the stage.
+        kwargs:
+            query(str or dict): query the work was done for, if any.
+            seconds(float): time spent.
+            calls(int): number of times the stage ran.
+            items(int): items processed.
+            bytes(int): bytes read or written.
+            retries(int): requests retried.
+            peak_memory(int): peak memory in bytes, kept if higher than the stage's mark.
+        """
+        if query is not None and not isinstance(query, basestring):
+            query = json.dumps(query, sort_keys=True)
+        with self.lock:
+            counters = self.stages.get((stage, query))
+            if counters is None:
+                counters = self.stages[(stage, query)] = dict((counter, 0) for counter in COUNTERS)
+                counters["peak_memory_bytes"] = 0
+            counters["seconds"] += seconds
+            counters["calls"] += calls
+            counters["items"] += items
+            counters["bytes"] += bytes
+            counters["retries"] += retries
+            counters["peak_memory_bytes"] = max(counters["peak_memory_bytes"], peak_memory)
+
+    @contextmanager
+    def stage(self, stage, query=None, items=0):
+        """Time a block of code as one run of a stage.
+
+        The StageTimer yielded can be given the items, bytes and retries of
+        the run as it goes:
+
+            with metrics.stage("tsv") as timer:
+                timer.items += 1
+
+        args:
+            stage(str): name of the stage.
+        kwargs:
+            query(str or dict): query the work is done for, if any.
+            items(int): items processed, if known in advance.
+        """
+        timer = StageTimer()
+        timer.items = items
+        start = time.time()
+        try:
+            yield timer
+        finally:
+            self.add(stage, query, seconds=time.time() - start, items=timer.items, bytes=timer.bytes,
+                     retries=timer.retries, peak_memory=peak_memory_bytes())
+
+    def consumer(self, stage, iterable, query=None):
+        """Yield the items of iterable, timing the code that consumes them as a stage.
+
+        Only the time between receiving an item and asking for the next one
+        is counted, so the work done to produce the items (e.g. a search
+        generator) is left out.
+
+        args:
+            stage(str): name of the stage.
+            iterable(iterable): items to consume, e.g. records from iter_arc_records.
+        kwargs:
+            query(str or dict): query the work is done for, if any.
+        """
+        seconds = 0.0
+        items = 0
+        try:
+            for item in iterable:
+                items += 1
+                start = time.time()
+                yield item
+                seconds += time.time() - start
+        finally:
+            self.add(stage, query, seconds=seconds, items=items, peak_memory=peak_memory_bytes())
+
+    @contextmanager
+    def profile(self, name):
+        """Profile a block of code with cProfile, if a profile_dir was given.
+
+        Stats are written to <profile_dir>/<name>.prof, for use with pstats or
+        snakeviz. Where tracemalloc is available (Python 3), the lines that
+        allocated the most memory are written to <name>.memory.txt. Blocks
+        inside a block already being profiled are not profiled separately.
+        """
+        if not self.profile_dir or self.profiling:
+            yield
+            return
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        self.profiling = True
+        profiler = cProfile.Profile()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.profiling = False
+            profiler.dump_stats(os.path.join(self.profile_dir, name + ".prof"))
+            if tracemalloc is not None:
+                statistics = tracemalloc.take_snapshot().statistics("lineno")
+                tracemalloc.stop()
+                with open(os.path.join(self.profile_dir, name + ".memory.txt"), "w") as memory_file:
+                    memory_file.write("\n".join(str(statistic) for statistic in statistics[:50]) + "\n")
+
+    def snapshot(self):
+        """Return the current counters as a JSON-serializable dict."""
+        with self.lock:
+            stages = [dict(counters, stage=stage, query=query)
+                      for (stage, query), counters in sorted(self.stages.items())]
+        return {"time": time.time(), "elapsed": time.time() - self.started,
+                "peak_memory_bytes": peak_memory_bytes(), "stages": stages}
+
+    def totals(self):
+        """Return the counters of each stage, summed over queries, with the highest memory mark."""
+        totals = {}
+        with self.lock:
+            for (stage, query), counters in self.stages.items():
+                stage_totals = totals.get(stage)
+                if stage_totals is None:
+                    stage_totals = totals[stage] = dict((counter, 0) for counter in COUNTERS)
+                    stage_totals["peak_memory_bytes"] = 0
+                for counter in COUNTERS:
+                    stage_totals[counter] += counters[counter]
+                stage_totals["peak_memory_bytes"] = max(stage_totals["peak_memory_bytes"],
+                                                        counters["peak_memory_bytes"])
+        return totals
+
+    def write_json(self, log_path):
+        """Append the current counters to a JSON log, as a single line."""
+        with open(log_path, "a") as log_file:
+            log_file.write(json.dumps(self.snapshot(), sort_keys=True) + "\n")
+
+    def write_prometheus(self, textfile_path, prefix="dpla"):
+        """Write stage totals in the Prometheus text format, e.g. for node_exporter's textfile collector.
+
+        The file is written under a temporary name and renamed, so it is never
+        read half-written.
+        """
+        lines = []
+        totals = sorted(self.totals().items())
+        for counter in COUNTERS:
+            name = "{0}_stage_{1}_total".format(prefix, counter)
+            lines.append("# HELP {0} Total {1} of each pipeline stage.".format(name, counter))
+            lines.append("# TYPE {0} counter".format(name))
+            for stage, stage_totals in totals:
+                lines.append("{0}{{stage=\"{1}\"}} {2}".format(name, _prometheus_label(stage),
+                                                                 repr(float(stage_totals[counter]))))
+        name = "{0}_stage_peak_memory_bytes".format(prefix)
+        lines.append("# HELP {0} Peak resident memory of the process when each stage last ended.".format(name))
+        lines.append("# TYPE {0} gauge".format(name))
+        for stage, stage_totals in totals:
+            lines.append("{0}{{stage=\"{1}\"}} {2}".format(name, _prometheus_label(stage),
+                                                             stage_totals["peak_memory_bytes"]))
+        name = "{0}_peak_memory_bytes".format(prefix)
+        lines.append("# HELP {0} Peak resident memory of the harvest process.".format(name))
+        lines.append("# TYPE {0} gauge".format(name))
+        lines.append("{0} {1}".format(name, peak_memory_bytes()))
+        with open(textfile_path + ".tmp", "w") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.rename(textfile_path + ".tmp", textfile_path)
+
+    def summary(self):
+        """Return a short table of stage totals, slowest first."""
+        lines = []
+        for stage, counters in sorted(self.totals().items(), key=lambda entry: -entry[1]["seconds"]):
+            lines.append("{0:>10}: {seconds:8.2f}s {calls:7d} calls {items:9d} items {bytes:12d} bytes "
+                         "{retries:4d} retries, peak {1:.0f} MB".format(
+                             stage, counters["peak_memory_bytes"] / 1024.0 ** 2, **counters))
+        lines.append("Peak memory: {0:.0f} MB".format(peak_memory_bytes() / 1024.0 ** 2))
+        return "\n".join(lines)
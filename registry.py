@@ -0,0 +1,171 @@
+"""Registry of DPLA items that have already been processed."""
+import fastjson
+import json
+import os
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def normalize_id(item_id):
+    """Reduce a DPLA item id or URL (e.g. http://dp.la/api/items/<id>) to the bare id."""
+    return os.path.basename(item_id.strip().rstrip("/"))
+
+
+def list_dir(path):
+    """Split the entries of a directory into (file names, subdirectory names).
+
+    Uses scandir when available, which avoids a stat call per entry.
+    """
+    files = []
+    subdirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path, name)):
+                subdirs.append(name)
+            else:
+                files.append(name)
+    return files, subdirs
+
+
+class MatchRegistry(object):
+    """Set-backed registry of processed item ids.
+
+    Ids are stored in a JSON snapshot (the configured match file) plus an
+    append-only log of ids added since the snapshot was last written.
+    Calling compact() folds the log back into the snapshot.
+    """
+
+    def __init__(self, match_file, flush_every=1000):
+        """Load ids from the snapshot and log.
+
+        args:
+            match_file(str): path to JSON list of processed ids.
+        kwargs:
+            flush_every(int): number of new ids buffered before appending to the log.
+        """
+        self.match_file = match_file
+        self.log_file = match_file + ".log"
+        self.scan_manifest = match_file + ".scan.json"
+        self.flush_every = flush_every
+        self.load()
+
+    def load(self):
+        """(Re)load ids from disk, discarding unflushed additions."""
+        self.ids = set()
+        self.pending = []
+        if os.path.exists(self.match_file):
+            with open(self.match_file, "rb") as match_file:
+                self.ids.update(normalize_id(item_id) for item_id in fastjson.load(match_file))
+        if os.path.exists(self.log_file):
+            with open(self.log_file, "r") as log_file:
+                self.ids.update(line.strip() for line in log_file if line.strip())
+
+    def __contains__(self, item_id):
+        return normalize_id(item_id) in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, item_id):
+        """Record an id as processed.
+
+        args:
+            item_id(str): DPLA item id or URL.
+        returns:
+            (bool) True if the id was new, False if it was already registered.
+        """
+        item_id = normalize_id(item_id)
+        if item_id in self.ids:
+            return False
+        self.ids.add(item_id)
+        self.pending.append(item_id)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Append buffered ids to the log."""
+        if self.pending:
+            with open(self.log_file, "a") as log_file:
+                log_file.write("".join(item_id + "\n" for item_id in self.pending))
+            self.pending = []
+
+    def compact(self):
+        """Rewrite the snapshot with every registered id and clear the log."""
+        with open(self.match_file + ".tmp", "w") as match_file:
+            json.dump(sorted(self.ids), match_file)
+        os.rename(self.match_file + ".tmp", self.match_file)
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.pending = []
+
+    def reset(self):
+        """Remove all ids. Takes effect on disk at the next compact()."""
+        self.ids = set()
+        self.pending = []
+
+    def scan_rdf_dir(self, rdf_dir, incremental=True):
+        """Register the ids of RDF files (<id>.xml) found under rdf_dir.
+
+        The mtime, RDF file count and subdirectories of every directory are
+        stored in a scan manifest. On an incremental scan, a directory whose
+        mtime is unchanged is not listed again; only its stored
+        subdirectories are checked.
+
+        args:
+            rdf_dir(str): directory in which to find rdf.
+        kwargs:
+            incremental(bool): reuse the manifest from the previous scan.
+        returns:
+            (tuple) count of new ids, count of ids already registered.
+        """
+        previous = {}
+        if incremental and os.path.exists(self.scan_manifest):
+            with open(self.scan_manifest, "rb") as manifest_file:
+                manifest = fastjson.load(manifest_file)
+            if manifest.get("rdf_dir") == rdf_dir:
+                previous = manifest["dirs"]
+
+        current = {}
+        new_count = 0
+        match_count = 0
+        paths = [rdf_dir]
+        while paths:
+            path = paths.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            entry = previous.get(path)
+            if entry is not None and entry["mtime"] == mtime:
+                match_count += entry["files"]
+            else:
+                files, subdirs = list_dir(path)
+                rdf_files = [os.path.splitext(f)[0] for f in files if f.endswith(".xml")]
+                for root_name in rdf_files:
+                    if self.add(root_name):
+                        new_count += 1
+                    else:
+                        match_count += 1
+                entry = {"mtime": mtime, "files": len(rdf_files), "subdirs": subdirs}
+            current[path] = entry
+            paths.extend(os.path.join(path, subdir) for subdir in entry["subdirs"])
+
+        # Ids must be on disk before the manifest marks their directories as scanned.
+        self.flush()
+        with open(self.scan_manifest + ".tmp", "w") as manifest_file:
+            json.dump({"rdf_dir": rdf_dir, "dirs": current}, manifest_file)
+        os.rename(self.scan_manifest + ".tmp", self.scan_manifest)
+        return new_count, match_count
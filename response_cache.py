@@ -0,0 +1,158 @@
+"""On-disk cache of DPLA search result pages."""
+import fastjson
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+
+class SearchResult(object):
+    """Page of search results, with the same attributes as a DPLA result."""
+
+    def __init__(self, count, limit, items):
+        """Set result attributes.
+
+        args:
+            count(int): total number of results for the query.
+            limit(int): number of results per page.
+            items(list): items on this page.
+        """
+        self.count = count
+        self.limit = limit
+        self.items = items
+
+
+class ResponseCache(object):
+    """Compressed, size-bounded cache of search result pages with TTL expiry.
+
+    Each page is stored as a zlib-compressed JSON file. A file's mtime is
+    updated whenever the page is read. Once the cache grows past max_bytes,
+    the least recently used pages are evicted until it is back under a
+    low-water mark, so the directory is not scanned again on every put.
+    """
+
+    def __init__(self, cache_dir="data/cache", ttl=86400, max_bytes=1024 ** 3, low_water=0.9):
+        """Prepare cache directory and measure its current size.
+
+        kwargs:
+            cache_dir(str): directory in which to store cached pages.
+            ttl(int): seconds after which a cached page is considered stale.
+            max_bytes(int): size budget for the cache directory.
+            low_water(float): fraction of max_bytes the cache is reduced to by eviction.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.size = sum(os.path.getsize(path) for path in self.__cache_files())
+
+    def key(self, q_value, page, page_size, fields=[]):
+        """Return cache key for a page request.
+
+        args:
+            q_value(str or dict): value searched, or dict of searchFields.
+            page(int): page of results.
+            page_size(int): number of results per page.
+        kwargs:
+            fields(list): fields requested for each item.
+        """
+        if isinstance(q_value, basestring):
+            q_value = " ".join(q_value.split())
+        request = [q_value, page, page_size, sorted(fields or [])]
+        return hashlib.sha1(json.dumps(request, sort_keys=True)).hexdigest()
+
+    def get(self, key):
+        """Return cached page for key, or None if it is missing or stale."""
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                data = fastjson.loads(zlib.decompress(cache_file.read()))
+        except (IOError, OSError, ValueError, zlib.error):
+            return None
+
+        if time.time() - data["fetched"] > self.ttl:
+            self.__remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return SearchResult(data["count"], data["limit"], data["items"])
+
+    def put(self, key, result):
+        """Store a page of results, evicting old pages if over budget.
+
+        args:
+            key(str): cache key from key().
+            result: search result with count, limit and items attributes.
+        """
+        payload = zlib.compress(json.dumps({
+            "fetched": time.time(),
+            "count": result.count,
+            "limit": result.limit,
+            "items": result.items,
+        }))
+        path = self.__path(key)
+        tmp_path = "{0}.{1}.tmp".format(path, threading.current_thread().ident)
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(payload)
+        with self.lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+            os.rename(tmp_path, path)
+            self.size += len(payload)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used pages until the cache is under the low-water mark."""
+        with self.lock:
+            entries = []
+            for path in self.__cache_files():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            self.size = sum(entry[1] for entry in entries)
+            target = self.max_bytes * self.low_water
+            for mtime, size, path in entries:
+                if self.size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self.size -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Remove every cached page."""
+        with self.lock:
+            for path in self.__cache_files():
+                os.remove(path)
+            self.size = 0
+
+    def __remove(self, path):
+        """Remove a single cached page."""
+        with self.lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+    def __path(self, key):
+        """Return path of the file holding a cached page."""
+        return os.path.join(self.cache_dir, key + ".json.z")
+
+    def __cache_files(self):
+        """Return paths of all cached pages."""
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                if name.endswith(".json.z")]
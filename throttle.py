@@ -0,0 +1,45 @@
+"""Rate limiting for requests made against remote APIs."""
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket used to keep requests within an API quota."""
+
+    def __init__(self, rate, capacity=None):
+        """Set refill rate and bucket size.
+
+        args:
+            rate(float): tokens added to the bucket per second.
+        kwargs:
+            capacity(int): max tokens the bucket can hold, i.e. the largest
+                burst allowed. Defaults to one second's worth of tokens.
+        """
+        if rate <= 0:
+            raise ValueError("Invalid rate: {0}".format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        """Block until the requested number of tokens is available, then take them.
+
+        kwargs:
+            tokens(int): number of tokens to take from the bucket.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def _refill(self):
+        """Add tokens accrued since the last refill."""
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
@@ -0,0 +1,89 @@
+"""Write metadata records to a TSV file as they arrive."""
+import io
+import json
+import os
+
+
+def format_value(value, clean_text=None):
+    """Format a record value as text.
+
+    Lists are joined with " | " (lists of lists are left blank), and values
+    that are not text, e.g. dict queries in "original_query", are JSON-encoded.
+
+    kwargs:
+        clean_text(function): applied to every text value.
+    """
+    if isinstance(value, list):
+        if any(isinstance(v, list) for v in value):
+            return u""
+        return u" | ".join([format_value(v, clean_text) for v in value if v is not None])
+    elif isinstance(value, basestring):
+        return value if clean_text is None else clean_text(value)
+    return unicode(json.dumps(value))
+
+
+class TsvWriter(object):
+    """Streaming TSV writer with a fixed column schema.
+
+    Every row has the same columns in the same order, whatever the order of
+    keys in the record. Columns missing from a record are left blank and
+    keys not in the schema are ignored.
+    """
+
+    def __init__(self, output_path, columns, append=False, buffer_size=1024 * 1024):
+        """Open output file and write headings, unless appending to a file that has them.
+
+        args:
+            output_path(str): path of the TSV file.
+            columns(list): column names, in output order.
+        kwargs:
+            append(bool): add rows to an existing file. Its headings must match columns.
+            buffer_size(int): bytes buffered before writing to disk.
+        """
+        self.output_path = output_path
+        self.columns = columns
+        self.records_written = 0
+        headings = "\t".join(columns) + "\n"
+        if append and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            with io.open(output_path, "r", encoding="utf-8", newline="\n") as existing_file:
+                existing_headings = existing_file.readline()
+            if existing_headings != headings:
+                raise ValueError("Columns of {0} do not match: {1}".format(output_path, existing_headings.strip()))
+            self.output_file = io.open(output_path, "a", encoding="utf-8", newline="\n", buffering=buffer_size)
+        else:
+            self.output_file = io.open(output_path, "w", encoding="utf-8", newline="\n", buffering=buffer_size)
+            self.output_file.write(unicode(headings))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        """Write one record as a row.
+
+        args:
+            record(dict): metadata record, e.g. from DplaApi.iter_arc_records.
+        """
+        cells = [self.format_value(record.get(column, u"")) for column in self.columns]
+        self.output_file.write(u"\t".join(cells) + u"\t\n")
+        self.records_written += 1
+
+    def format_value(self, value):
+        """Format a value as a single TSV cell.
+
+        Lists are joined with " | " (lists of lists are left blank), text has
+        tabs and line breaks replaced by spaces, and other values are JSON-encoded.
+        """
+        return format_value(value, self.__clean)
+
+    def close(self):
+        """Flush buffered rows and close the file."""
+        self.output_file.close()
+
+    def __clean(self, text):
+        """Replace characters that would break the row or column structure."""
+        if isinstance(text, str):
+            text = text.decode("utf-8")
+        return text.replace(u"\t", u" ").replace(u"\r", u" ").replace(u"\n", u" ")